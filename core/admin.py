@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import Amenity, Space, Booking, OccupancyLog
+from .models import Amenity, Site, Space, Booking, OccupancyLog
+
+@admin.register(Site)
+class SiteAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'opens_at', 'closes_at')
+    search_fields = ('name',)
+    prepopulated_fields = {'slug': ('name',)}
 
 @admin.register(Amenity)
 class AmenityAdmin(admin.ModelAdmin):
@@ -8,17 +14,21 @@ class AmenityAdmin(admin.ModelAdmin):
 
 @admin.register(Space)
 class SpaceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'capacity', 'price_per_hour')
+    list_display = ('name', 'site', 'capacity', 'price_per_hour', 'forecast_engine')
     search_fields = ('name', 'description')
-    list_filter = ('capacity',)
+    list_filter = ('site', 'capacity', 'forecast_engine')
+    list_select_related = ('site',)
 
+# Filtering by site keeps the changelists on the site-leading indexes
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('user', 'space', 'start_time', 'end_time', 'status')
     search_fields = ('user__username', 'space__name')
-    list_filter = ('status', 'start_time')
+    list_filter = ('site', 'status', 'start_time')
+    list_select_related = ('user', 'space')
 
 @admin.register(OccupancyLog)
 class OccupancyLogAdmin(admin.ModelAdmin):
-    list_display = ('space', 'timestamp', 'occupied_count', 'temperature')
-    list_filter = ('space', 'is_holiday')
+    list_display = ('space', 'timestamp', 'sensor_id', 'occupied_count', 'is_anomaly', 'temperature')
+    list_filter = ('site', 'space', 'is_holiday', 'is_anomaly')
+    list_select_related = ('space',)
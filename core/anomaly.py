@@ -0,0 +1,145 @@
+"""
+Streaming anomaly detection for occupancy readings.
+
+Every reading is compared with the recent readings of the same space,
+hour of day and kind of day (weekday or weekend) using a robust modified
+z-score (median and MAD), then stored with the result in
+OccupancyLog.is_anomaly. Graphs and forecasts filter on that flag
+instead of recomputing statistics per request.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+from .models import OccupancyLog
+
+# Recent readings kept per (space, weekend, hour of day)
+WINDOW = 50
+# Readings needed in a window before anything is flagged
+MIN_SAMPLES = 10
+# Modified z-score above which a reading is an anomaly (Iglewicz & Hoaglin)
+THRESHOLD = 3.5
+# Counts are whole seats, so the spread never drops below one seat
+MIN_SCALE = 1.0
+
+
+class AnomalyDetector:
+    """
+    Keeps a sliding window of readings per (space, weekend, hour) and scores new
+    readings against its median and MAD. Windows of a space are warmed from
+    the database the first time the space is seen, unless `warm` is False.
+    """
+
+    def __init__(self, warm=True):
+        self.warm = warm
+        self.windows = {}
+        self.known_spaces = set()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.windows.clear()
+            self.known_spaces.clear()
+
+    def warm_up(self, space_id):
+        recent = OccupancyLog.objects.filter(space_id=space_id).order_by('-timestamp').values_list(
+            'timestamp', 'occupied_count'
+        )[:WINDOW * 24 * 2]
+        # Oldest first, so each window ends with its newest readings
+        for timestamp, count in reversed(list(recent)):
+            self.window(space_id, timestamp).append(count)
+
+    def window(self, space_id, timestamp):
+        return self.window_for(space_id, timestamp.weekday() >= 5, timestamp.hour)
+
+    def window_for(self, space_id, weekend, hour):
+        key = (space_id, weekend, hour)
+        if key not in self.windows:
+            self.windows[key] = deque(maxlen=WINDOW)
+        return self.windows[key]
+
+    def know(self, space_id):
+        if space_id not in self.known_spaces:
+            self.known_spaces.add(space_id)
+            if self.warm:
+                self.warm_up(space_id)
+
+    @staticmethod
+    def centre_and_scale(window):
+        """Median and robust spread of a window, or None while it is too short."""
+        if len(window) < MIN_SAMPLES:
+            return None
+        values = np.fromiter(window, dtype=float, count=len(window))
+        median = np.median(values)
+        # 1.4826 * MAD estimates the standard deviation of normal data
+        return median, max(1.4826 * np.median(np.abs(values - median)), MIN_SCALE)
+
+    def score(self, space_id, timestamp, count):
+        """Returns True if the reading is an anomaly, then adds it to its window."""
+        with self.lock:
+            self.know(space_id)
+            window = self.window(space_id, timestamp)
+            stats = self.centre_and_scale(window)
+            anomaly = stats is not None and abs(count - stats[0]) / stats[1] > THRESHOLD
+            window.append(count)
+            return bool(anomaly)
+
+    def score_many(self, space_ids, timestamps_us, counts):
+        """
+        Vectorised `score` for arrays of readings with UTC epoch microsecond
+        timestamps. Readings of one batch are scored against their window
+        as it was before the batch, then appended in timestamp order.
+        Returns a bool array.
+        """
+        hours = timestamps_us // 3_600_000_000
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekend = (hours // 24 + 3) % 7 >= 5
+        keys = space_ids.astype(np.int64) * 48 + weekend * 24 + hours % 24
+        order = np.lexsort((timestamps_us, keys))
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        flags = np.zeros(len(counts), dtype=bool)
+        with self.lock:
+            for key, group in zip(unique_keys.tolist(), np.split(order, starts[1:])):
+                space_id, slot = divmod(key, 48)
+                self.know(space_id)
+                window = self.window_for(space_id, slot >= 24, slot % 24)
+                group_counts = counts[group]
+                stats = self.centre_and_scale(window)
+                if stats is not None:
+                    flags[group] = np.abs(group_counts - stats[0]) / stats[1] > THRESHOLD
+                window.extend(group_counts.tolist())
+        return flags
+
+    def flag(self, logs):
+        """Sets is_anomaly on unsaved logs, in timestamp order."""
+        for log in sorted(logs, key=lambda log: log.timestamp):
+            log.is_anomaly = self.score(log.space_id, log.timestamp, log.occupied_count)
+        return logs
+
+
+def rescore_space(detector, logs, chunk_size=5000):
+    """
+    Scores one space's `logs` (a queryset) oldest first and writes the
+    flags that changed. Returns (scored, changed). bulk_update sends no
+    signals.
+    """
+    logs = logs.order_by('timestamp', 'pk').only('pk', 'space_id', 'timestamp', 'occupied_count', 'is_anomaly')
+    scored = changed = 0
+    updates = []
+    for log in logs.iterator(chunk_size=chunk_size):
+        flagged = detector.score(log.space_id, log.timestamp, log.occupied_count)
+        scored += 1
+        if flagged != log.is_anomaly:
+            log.is_anomaly = flagged
+            updates.append(log)
+        if len(updates) >= chunk_size:
+            logs.model.objects.bulk_update(updates, ['is_anomaly'])
+            changed += len(updates)
+            updates = []
+    logs.model.objects.bulk_update(updates, ['is_anomaly'])
+    return scored, changed + len(updates)
+
+
+# Shared by the save signal and the ingest buffer of this process
+detector = AnomalyDetector()
@@ -0,0 +1,182 @@
+"""
+Booking operations: recurrence expansion, batched capacity checks, bulk
+creation and the lifecycle job that runs outside the request cycle.
+"""
+import datetime
+import time
+import uuid
+from itertools import islice
+
+import numpy as np
+from dateutil import rrule
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Booking, Space
+from .timeline import apply_booking_changes, get_timelines, peak_upper_bounds
+from .utils import bump_data_version
+
+REPEAT_RULES = {
+    'daily': {'freq': rrule.DAILY},
+    'weekdays': {'freq': rrule.DAILY, 'byweekday': (rrule.MO, rrule.TU, rrule.WE, rrule.TH, rrule.FR)},
+    'weekly': {'freq': rrule.WEEKLY},
+}
+# A year of daily bookings, with room for a leap day
+MAX_OCCURRENCES = 366
+
+
+def expand_recurrence(start, end, repeat='none', until=None):
+    """
+    Expands one booking slot into a list of (start, end) occurrences
+    following `repeat` ('none' or a REPEAT_RULES key) up to and including
+    the date `until`.
+    """
+    if repeat == 'none':
+        return [(start, end)]
+    last_start = timezone.make_aware(datetime.datetime.combine(until, datetime.time.max), start.tzinfo)
+    # One past the limit is enough to reject, however far away `until` is
+    starts = list(islice(rrule.rrule(dtstart=start, until=last_start, **REPEAT_RULES[repeat]), MAX_OCCURRENCES + 1))
+    if len(starts) > MAX_OCCURRENCES:
+        raise ValidationError(f"A recurring booking can have at most {MAX_OCCURRENCES} occurrences.")
+    duration = end - start
+    occurrences = [(occurrence, occurrence + duration) for occurrence in starts]
+    if any(next_start < previous_end for (_, previous_end), (next_start, _) in zip(occurrences, occurrences[1:])):
+        raise ValidationError("Occurrences of a recurring booking must not overlap each other.")
+    return occurrences
+
+
+def find_capacity_conflicts(space, occurrences, exclude_pk=None, timeline=None):
+    """
+    Returns the occurrences during which the space is already fully booked.
+
+    With a `timeline` (origin, counts) from core/timeline.py, occurrences
+    whose slot counts stay below capacity are accepted without a query.
+    The rest are checked exactly: confirmed bookings over their span are
+    read in one query and turned into a step function of concurrent
+    bookings, whose peak inside every occurrence is found with NumPy.
+    """
+    if timeline is not None and space.capacity > 0:
+        bounds = peak_upper_bounds(timeline, occurrences)
+        occurrences = [
+            occurrence for occurrence, bound in zip(occurrences, bounds)
+            if bound is None or bound >= space.capacity
+        ]
+    if not occurrences:
+        return []
+    starts = np.array([start.timestamp() for start, _ in occurrences])
+    ends = np.array([end.timestamp() for _, end in occurrences])
+
+    existing = Booking.objects.filter(
+        space=space, status='confirmed',
+        start_time__lt=occurrences[-1][1], end_time__gt=occurrences[0][0],
+    )
+    if exclude_pk is not None:
+        existing = existing.exclude(pk=exclude_pk)
+    rows = list(existing.values_list('start_time', 'end_time'))
+    if not rows:
+        return [] if space.capacity > 0 else list(occurrences)
+
+    # Each booking adds one at its start and removes one at its end
+    times = np.array([moment.timestamp() for row in rows for moment in row])
+    deltas = np.tile([1, -1], len(rows))
+    # Ends sort before starts at the same instant, back-to-back bookings don't overlap
+    order = np.lexsort((deltas, times))
+    times = times[order]
+    concurrent = np.cumsum(deltas[order])
+    # Sentinel so every reduceat index below is in range
+    padded = np.append(concurrent, 0)
+
+    # Bookings active at the start of each occurrence
+    first = np.searchsorted(times, starts, side='right')
+    at_start = np.where(first > 0, padded[first - 1], 0)
+    # Peak over the changes strictly inside each occurrence
+    last = np.searchsorted(times, ends, side='left')
+    bounds = np.column_stack([first, last]).ravel()
+    inside = np.maximum.reduceat(padded, bounds)[::2]
+    peak = np.maximum(at_start, np.where(last > first, inside, 0))
+
+    return [occurrence for occurrence, full in zip(occurrences, peak >= space.capacity) if full]
+
+
+def create_bookings(user, space, occurrences):
+    """
+    Validates all occurrences against capacity and creates them with one
+    bulk_create inside a single transaction. Occurrences of a recurring
+    booking share a series id. Raises ValidationError listing the full slots.
+    """
+    with transaction.atomic():
+        # Serialise concurrent bookings of the same space where supported
+        space = Space.objects.select_for_update().get(pk=space.pk)
+        conflicts = find_capacity_conflicts(space, occurrences, timeline=space_timeline(space))
+        if conflicts:
+            dates = ', '.join(timezone.localtime(start).strftime('%b %d %H:%M') for start, _ in conflicts[:5])
+            more = f" and {len(conflicts) - 5} more" if len(conflicts) > 5 else ""
+            raise ValidationError(f"{space.name} is fully booked on {dates}{more}.")
+        series = uuid.uuid4() if len(occurrences) > 1 else None
+        bookings = Booking.objects.bulk_create([
+            Booking(user=user, space=space, site_id=space.site_id, start_time=start, end_time=end, series=series)
+            for start, end in occurrences
+        ])
+        # bulk_create skips the signals that keep the timeline current
+        apply_booking_changes(space.pk, added=occurrences)
+    bump_data_version('bookings', space.site_id)
+    return bookings
+
+
+def space_timeline(space):
+    """(origin, counts) of one space's current booking timeline."""
+    origin, timelines = get_timelines([space.pk])
+    return origin, timelines[space.pk]
+
+
+def reschedule_booking(form):
+    """
+    Saves an edited booking after checking its new slot against capacity,
+    not counting the booking itself. Raises ValidationError when full.
+    """
+    booking = form.instance
+    with transaction.atomic():
+        space = Space.objects.select_for_update().get(pk=booking.space_id)
+        slot = (form.cleaned_data['start_time'], form.cleaned_data['end_time'])
+        if find_capacity_conflicts(space, [slot], exclude_pk=booking.pk, timeline=space_timeline(space)):
+            raise ValidationError(f"{space.name} is fully booked at that time.")
+        return form.save()
+
+
+def complete_expired_bookings(now=None, chunk_size=5000, pause=0.0, on_chunk=None):
+    """
+    Moves confirmed bookings that ended before `now` to completed.
+
+    Works in chunks of `chunk_size` primary keys read from the
+    (status, end_time) index, each updated in its own short transaction, so
+    table locks stay brief and an interrupted run simply resumes on the next
+    call. Bookings already completed or cancelled are never touched, which
+    makes the job idempotent. `on_chunk(updated, total)` is called after each
+    chunk. Returns the number of bookings completed.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Booking.objects.filter(status='confirmed', end_time__lte=now)
+                .order_by('end_time', 'pk')
+                .values_list('pk', 'site_id')[:chunk_size]
+            )
+            if not rows:
+                break
+            ids, site_ids = zip(*rows)
+            # Re-check the status in case a booking was cancelled meanwhile
+            updated = Booking.objects.filter(pk__in=ids, status='confirmed').update(status='completed')
+        total += updated
+        # update() skips signals. The timelines need no patch: an ended
+        # booking can only still touch the current slot, which rolls off
+        # the window within 15 minutes.
+        for site_id in set(site_ids):
+            bump_data_version('bookings', site_id)
+        if on_chunk:
+            on_chunk(updated, total)
+        if pause:
+            time.sleep(pause)
+    return total
@@ -0,0 +1,147 @@
+"""
+Occupancy forecast models.
+
+Kept free of Django imports so they can run inside worker processes
+(see core/backtest.py) on plain NumPy/pandas inputs.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+# Ensure weekends are visibly lower even if the model says otherwise
+WEEKEND_FACTOR = 0.6
+SMOOTHING_WINDOW = 3
+
+
+def median_forecast(df, future_times):
+    """
+    Weekday/hour median model behind the prediction graph.
+
+    `df` holds 'timestamp' (UTC) and 'occupied_count' columns, `future_times`
+    is a contiguous hourly DatetimeIndex. Slots never seen in training fall
+    back to the median of the same hour across all days, then to 0.
+    Returns a float array aligned with `future_times`.
+    """
+    future_times = pd.DatetimeIndex(future_times)
+    if df.empty:
+        return np.zeros(len(future_times))
+
+    day_of_week = df['timestamp'].dt.dayofweek.rename('day_of_week')
+    hour = df['timestamp'].dt.hour.rename('hour')
+    counts = df['occupied_count']
+
+    # Median is more robust to outliers than mean
+    by_slot = counts.groupby([day_of_week, hour]).median()
+    by_hour = counts.groupby(hour).median()
+
+    slots = pd.MultiIndex.from_arrays([future_times.dayofweek, future_times.hour])
+    values = by_slot.reindex(slots).to_numpy(dtype=float)
+    fallback = by_hour.reindex(future_times.hour).to_numpy(dtype=float)
+    values = np.nan_to_num(np.where(np.isnan(values), fallback, values))
+    values *= np.where(future_times.dayofweek >= 5, WEEKEND_FACTOR, 1.0)
+
+    # Predictions can be jumpy (e.g., 10am=5, 11am=15), a small rolling
+    # window "connects" the dots better
+    return pd.Series(values).rolling(window=SMOOTHING_WINDOW, min_periods=1, center=True).mean().to_numpy()
+
+
+# Weather and external factors used by the linear model, in column order
+FEATURE_COLUMNS = ('temperature', 'pressure', 'precipitation', 'traffic_index', 'is_holiday')
+# Fixed (centre, spread) per feature rather than fitted ones, so statistics
+# accumulated across incremental refits stay on the same scale
+FEATURE_SCALE = {
+    'temperature': (20.0, 10.0),
+    'pressure': (760.0, 10.0),
+    'precipitation': (0.0, 10.0),
+    'traffic_index': (5.0, 5.0),
+    'is_holiday': (0.0, 1.0),
+}
+# Intercept, 7 weekday one-hots, 24 hour one-hots, then the features
+N_TERMS = 1 + 7 + 24 + len(FEATURE_COLUMNS)
+
+
+def weekday_hour_slots(timestamps):
+    """Index 0..167 of the (weekday, hour) slot of each timestamp."""
+    timestamps = pd.DatetimeIndex(timestamps)
+    return np.asarray(timestamps.dayofweek * 24 + timestamps.hour)
+
+
+def scaled_features(weather):
+    """Scales FEATURE_COLUMNS of `weather`; missing readings become NaN."""
+    columns = [
+        (np.asarray(weather[name], dtype=float) - centre) / spread
+        for name, (centre, spread) in FEATURE_SCALE.items()
+    ]
+    return np.column_stack(columns)
+
+
+def design_matrix(timestamps, features):
+    """Builds the linear model inputs from timestamps and scaled features."""
+    timestamps = pd.DatetimeIndex(timestamps)
+    rows = np.arange(len(timestamps))
+    X = np.zeros((len(timestamps), N_TERMS))
+    X[:, 0] = 1.0
+    X[rows, 1 + np.asarray(timestamps.dayofweek)] = 1.0
+    X[rows, 8 + np.asarray(timestamps.hour)] = 1.0
+    # A missing reading contributes nothing, same as an average one
+    X[:, 32:] = np.nan_to_num(features)
+    return X
+
+
+class LinearForecast:
+    """
+    Ridge regression of occupancy on weekday/hour one-hots plus weather.
+
+    Only X'X, X'y and per-slot weather sums are kept, so new logs can be
+    folded in with `partial_fit` and the model re-solved without revisiting
+    old rows. Future weather is unknown, `predict` falls back to the mean
+    of each feature seen in the same weekday/hour slot.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.xtx = np.zeros((N_TERMS, N_TERMS))
+        self.xty = np.zeros(N_TERMS)
+        self.samples = 0
+        self.last_log_id = 0
+        # Epoch seconds when the model started from scratch
+        self.fitted_at = time.time()
+        self.slot_sums = np.zeros((168, len(FEATURE_COLUMNS)))
+        self.slot_counts = np.zeros((168, len(FEATURE_COLUMNS)))
+        self.coef = None
+
+    def partial_fit(self, timestamps, weather, counts):
+        features = scaled_features(weather)
+        X = design_matrix(timestamps, features)
+        y = np.asarray(counts, dtype=float)
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.samples += len(y)
+
+        seen = ~np.isnan(features)
+        slots = weekday_hour_slots(timestamps)
+        np.add.at(self.slot_sums, slots, np.where(seen, features, 0.0))
+        np.add.at(self.slot_counts, slots, seen)
+        self.coef = None
+        return self
+
+    def solve(self):
+        penalty = self.alpha * np.eye(N_TERMS)
+        penalty[0, 0] = 0.0  # Leave the intercept unpenalised
+        self.coef = np.linalg.lstsq(self.xtx + penalty, self.xty, rcond=None)[0]
+        return self
+
+    def predict(self, future_times, weather=None):
+        if not self.samples:
+            return np.zeros(len(future_times))
+        if self.coef is None:
+            self.solve()
+        if weather is None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                climate = self.slot_sums / self.slot_counts
+            features = climate[weekday_hour_slots(future_times)]
+        else:
+            features = scaled_features(weather)
+        prediction = design_matrix(future_times, features) @ self.coef
+        return np.clip(prediction, 0, None)
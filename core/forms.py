@@ -1,4 +1,5 @@
 from django import forms
+from .bookings import expand_recurrence
 from .models import Booking
 
 class BookingForm(forms.ModelForm):
@@ -18,3 +19,42 @@ class BookingForm(forms.ModelForm):
         if start and end:
             if end <= start:
                 raise forms.ValidationError("End time must be after start time.")
+        return cleaned_data
+
+
+class RecurringBookingForm(BookingForm):
+    REPEAT_CHOICES = [
+        ('none', 'Does not repeat'),
+        ('daily', 'Every day'),
+        ('weekdays', 'Every weekday (Mon-Fri)'),
+        ('weekly', 'Every week'),
+    ]
+    # Optional so clients that only post the slot keep making single bookings
+    repeat = forms.ChoiceField(
+        choices=REPEAT_CHOICES, initial='none', required=False,
+        widget=forms.Select(attrs={'class': 'w-full p-2 border rounded'}),
+    )
+    repeat_until = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'w-full p-2 border rounded'}),
+    )
+
+    def clean_repeat(self):
+        return self.cleaned_data['repeat'] or 'none'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("start_time")
+        end = cleaned_data.get("end_time")
+        repeat = cleaned_data.get("repeat")
+        until = cleaned_data.get("repeat_until")
+
+        if repeat and repeat != 'none':
+            if not until:
+                raise forms.ValidationError("Choose the date the booking repeats until.")
+            if start and until < start.date():
+                raise forms.ValidationError("Repeat-until date must not be before the start date.")
+
+        if start and end and repeat:
+            cleaned_data['occurrences'] = expand_recurrence(start, end, repeat, until)
+        return cleaned_data
@@ -0,0 +1,220 @@
+"""
+Write-behind ingestion of sensor readings.
+
+Readings are collected in memory (and optionally appended to a local
+spool file), deduplicated on their (space, sensor, timestamp) key and
+written to OccupancyLog in large batches once enough readings are pending
+or the oldest one has waited long enough. The unique_sensor_reading
+constraint makes every flush idempotent, so a spool replayed after a crash
+between commit and truncation cannot create duplicates.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.db import transaction
+
+from .anomaly import detector
+from .models import OccupancyLog, Space
+from .utils import bump_data_version
+
+READING_FIELDS = (
+    'space_id', 'site_id', 'sensor_id', 'timestamp', 'occupied_count',
+    'temperature', 'pressure', 'precipitation', 'traffic_index', 'is_holiday',
+)
+
+
+class IngestBuffer:
+    """
+    Buffers readings and flushes them to the database in one transaction.
+
+    `max_batch` readings or `max_delay` seconds since the oldest pending
+    reading trigger a flush on the next `add`; call `start()` to also flush
+    from a background thread when no new readings arrive. With `spool_path`
+    every accepted reading is written to that file before `add` returns and
+    replayed on construction, so readings survive a crashed or killed
+    process; `fsync` also makes them survive a power loss, at the cost of a
+    disk sync per call. Readings of spaces that do not exist are dropped
+    on flush and counted as rejected.
+    """
+
+    def __init__(self, spool_path=None, max_batch=1000, max_delay=1.0, fsync=False):
+        self.spool_path = spool_path
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = {}
+        self.oldest_pending = None
+        self.lock = threading.RLock()
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_seconds = deque(maxlen=100)
+        self.timer = None
+        self.stopping = threading.Event()
+        self.spool = None
+        if spool_path:
+            self.replay()
+            self.spool = open(spool_path, 'a', encoding='utf-8')
+
+    def replay(self):
+        """Loads readings left in the spool by a previous process and flushes them."""
+        if not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path, encoding='utf-8') as spool:
+            for line in spool:
+                try:
+                    reading = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                reading['timestamp'] = datetime.datetime.fromisoformat(reading['timestamp'])
+                self._remember(reading)
+        replayed = len(self.pending)
+        self.flush()
+        return replayed
+
+    def add(self, space_id, timestamp, occupied_count, sensor_id='', **weather):
+        """
+        Accepts one reading. Returns False if a reading with the same
+        (space, sensor, timestamp) key is already pending.
+        """
+        reading = {
+            'space_id': space_id, 'sensor_id': sensor_id, 'timestamp': timestamp,
+            'occupied_count': occupied_count, **weather,
+        }
+        with self.lock:
+            if not self._remember(reading):
+                return False
+            if self.spool:
+                self.spool.write(json.dumps(reading, default=datetime.datetime.isoformat) + '\n')
+                self.sync_spool()
+            if self.due():
+                self.flush()
+        return True
+
+    def add_many(self, readings):
+        """Accepts an iterable of reading dicts, returns how many were new."""
+        with self.lock:
+            added = 0
+            lines = []
+            for reading in readings:
+                if self._remember(dict(reading)):
+                    added += 1
+                    if self.spool:
+                        lines.append(json.dumps(reading, default=datetime.datetime.isoformat) + '\n')
+            if lines:
+                self.spool.writelines(lines)
+                self.sync_spool()
+            if self.due():
+                self.flush()
+        return added
+
+    def sync_spool(self):
+        """Hands spooled lines to the OS, and to the disk with `fsync`."""
+        self.spool.flush()
+        if self.fsync:
+            os.fsync(self.spool.fileno())
+
+    def _remember(self, reading):
+        key = (reading['space_id'], reading.get('sensor_id', ''), reading['timestamp'])
+        # Manual readings without a sensor id have no idempotency key
+        if key[1] and key in self.pending:
+            self.duplicates += 1
+            return False
+        if not key[1]:
+            key = key + (self.accepted,)
+        self.pending[key] = reading
+        self.accepted += 1
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+        return True
+
+    def due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.max_batch or time.monotonic() - self.oldest_pending >= self.max_delay
+
+    def flush(self):
+        """Writes every pending reading in one transaction, returns the count written."""
+        with self.lock:
+            if not self.pending:
+                return 0
+            started = time.perf_counter()
+            logs = [
+                OccupancyLog(**{field: value for field, value in reading.items() if field in READING_FIELDS})
+                for reading in self.pending.values()
+            ]
+            # bulk_create skips the save signals that copy the site and score
+            # single readings
+            sites = dict(Space.objects.filter(pk__in={log.space_id for log in logs}).values_list('pk', 'site_id'))
+            # Readings of unknown spaces would fail every flush, and the replay
+            known = [log for log in logs if log.space_id in sites]
+            self.rejected += len(logs) - len(known)
+            logs = known
+            for log in logs:
+                if log.site_id is None:
+                    log.site_id = sites[log.space_id]
+            detector.flag(logs)
+            if logs:
+                with transaction.atomic():
+                    # Readings already stored by an earlier flush are skipped
+                    OccupancyLog.objects.bulk_create(logs, batch_size=self.max_batch, ignore_conflicts=True)
+            count = len(logs)
+            self.pending.clear()
+            self.oldest_pending = None
+            if self.spool:
+                self.spool.seek(0)
+                self.spool.truncate()
+            elif self.spool_path:
+                open(self.spool_path, 'w').close()
+            for site_id in {log.site_id for log in logs}:
+                bump_data_version('logs', site_id)
+            self.flushed += count
+            self.flushes += 1
+            self.flush_seconds.append(time.perf_counter() - started)
+            return count
+
+    def start(self):
+        """Flushes on the time threshold from a daemon thread until `stop()`."""
+        def run():
+            while not self.stopping.wait(self.max_delay / 4):
+                if self.due():
+                    self.flush()
+        self.stopping.clear()
+        self.timer = threading.Thread(target=run, daemon=True)
+        self.timer.start()
+
+    def stop(self):
+        """Stops the timer thread, flushes what is left and closes the spool."""
+        self.stopping.set()
+        if self.timer:
+            self.timer.join()
+            self.timer = None
+        self.flush()
+        if self.spool:
+            self.spool.close()
+            self.spool = None
+
+    def metrics(self):
+        """Backlog and flush statistics for monitoring."""
+        with self.lock:
+            latencies = np.asarray(self.flush_seconds) * 1000
+            return {
+                'backlog': len(self.pending),
+                'oldest_pending_seconds': time.monotonic() - self.oldest_pending if self.pending else 0.0,
+                'accepted': self.accepted,
+                'duplicates': self.duplicates,
+                'rejected': self.rejected,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'flush_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'flush_ms_p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'flush_ms_last': float(latencies[-1]) if len(latencies) else None,
+            }
@@ -0,0 +1,334 @@
+"""
+Binary sensor ingestion over TCP and UDP.
+
+Gateways send fixed-width little-endian records of RECORD_SIZE bytes: on
+TCP as one continuous stream, on UDP as datagrams holding whole records.
+Records are decoded in bulk with NumPy and written to OccupancyLog by one
+writer thread in large multi-row INSERTs, so the event loop only ever
+copies bytes. NaN weather fields mean "not measured" and are stored as
+NULL. Like IngestBuffer, inserts ignore rows that violate the
+unique_sensor_reading constraint, so gateways can resend safely.
+Records of unknown spaces or with timestamps outside the accepted window
+(MAX_CLOCK_SKEW ahead, `max_age` behind) are counted as rejected.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db import connection, connections, transaction
+from django.db.models.constants import OnConflict
+
+from .anomaly import detector
+from .models import OccupancyLog, Space
+from .utils import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+RECORD = np.dtype([
+    ('space_id', '<u4'),
+    # 0 for readings without a sensor id
+    ('sensor', '<u4'),
+    # UTC, microseconds since the epoch
+    ('timestamp', '<i8'),
+    ('temperature', '<f4'),
+    ('pressure', '<f4'),
+    ('precipitation', '<f4'),
+    ('occupied_count', '<u2'),
+    ('traffic_index', 'u1'),
+    # Bit 0: holiday
+    ('flags', 'u1'),
+])
+RECORD_SIZE = RECORD.itemsize
+
+# Gateways ahead of the server by more than this are rejected
+MAX_CLOCK_SKEW_US = 24 * 60 * 60 * 1_000_000
+
+INSERT_FIELDS = (
+    'site', 'space', 'sensor_id', 'timestamp', 'occupied_count', 'temperature',
+    'pressure', 'precipitation', 'traffic_index', 'is_holiday', 'is_anomaly',
+)
+
+
+def encode_records(space_ids, timestamps, counts, sensors=0, temperature=np.nan, pressure=np.nan,
+                   precipitation=np.nan, traffic_index=0, holiday=False):
+    """
+    Packs readings into the wire format. `timestamps` are aware datetimes
+    or UTC epoch microseconds; every argument may be a scalar or an array.
+    """
+    counts = np.asarray(counts)
+    records = np.zeros(len(counts), dtype=RECORD)
+    if len(timestamps) and not np.issubdtype(np.asarray(timestamps).dtype, np.integer):
+        timestamps = [round(timestamp.timestamp() * 1_000_000) for timestamp in timestamps]
+    records['space_id'] = space_ids
+    records['sensor'] = sensors
+    records['timestamp'] = timestamps
+    records['temperature'] = temperature
+    records['pressure'] = pressure
+    records['precipitation'] = precipitation
+    records['occupied_count'] = counts
+    records['traffic_index'] = traffic_index
+    records['flags'] = np.asarray(holiday, dtype=np.uint8)
+    return records.tobytes()
+
+
+def decode_records(data):
+    """Decodes whole records from a bytes-like object, ignoring a partial tail."""
+    return np.frombuffer(data, dtype=RECORD, count=len(data) // RECORD_SIZE)
+
+
+def nullable(values, decimals=2):
+    """Float column as a list with NaN replaced by None."""
+    column = np.round(values.astype(np.float64), decimals).astype(object)
+    column[np.isnan(values)] = None
+    return column.tolist()
+
+
+def db_timestamps(micros):
+    """
+    Epoch microseconds as values the database driver stores like the ORM
+    does for DateTimeField. Django keeps connections in UTC when USE_TZ is
+    on, so naive UTC values are correct for every backend.
+    """
+    values = micros.astype('datetime64[us]')
+    if connection.vendor != 'sqlite':
+        return values.astype(object).tolist()
+    # SQLite stores str(datetime): space separator, no zero microseconds
+    text = np.char.replace(np.datetime_as_string(values, unit='us'), 'T', ' ')
+    text = np.char.replace(text, '.000000', '')
+    return text.tolist()
+
+
+def insert_sql(rows):
+    """INSERT of `rows` readings that skips rows violating a unique constraint."""
+    opts = OccupancyLog._meta
+    fields = [opts.get_field(name) for name in INSERT_FIELDS]
+    quote = connection.ops.quote_name
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    return '{} {} ({}) VALUES {}{}'.format(
+        connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        quote(opts.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join([row] * rows),
+        connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None) or '',
+    )
+
+
+class SensorListener:
+    """
+    Collects decoded records from any number of connections and writes
+    them in batches of up to `max_batch` rows, at least every `max_delay`
+    seconds. TCP connections are paused while more than `max_backlog`
+    records wait for the writer. `sensor_prefix` is prepended to the
+    numeric sensor id to form OccupancyLog.sensor_id. Readings older than
+    `max_age` seconds are rejected along with those from the future.
+    """
+
+    def __init__(self, max_batch=20000, max_delay=0.5, max_backlog=200000, sensor_prefix='', max_age=24 * 60 * 60):
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.max_delay = max_delay
+        self.max_backlog = max_backlog
+        self.sensor_prefix = sensor_prefix
+        self.pending = deque()
+        self.backlog = 0
+        self.transports = set()
+        self.paused = False
+        self.wakeup = asyncio.Event()
+        # One thread, so batches commit in arrival order on one connection
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sensor-writer')
+        self.received = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+
+    def accept(self, records):
+        """Queues decoded records from the event loop."""
+        if not len(records):
+            return
+        self.pending.append(records)
+        self.backlog += len(records)
+        self.received += len(records)
+        if self.backlog >= self.max_batch:
+            self.wakeup.set()
+        if self.backlog >= self.max_backlog and not self.paused:
+            self.paused = True
+            for transport in self.transports:
+                transport.pause_reading()
+
+    def take_batch(self):
+        batch = []
+        size = 0
+        while self.pending and size < self.max_batch:
+            records = self.pending.popleft()
+            batch.append(records)
+            size += len(records)
+        self.backlog -= size
+        if self.paused and self.backlog < self.max_backlog // 2:
+            self.paused = False
+            for transport in self.transports:
+                transport.resume_reading()
+        return np.concatenate(batch) if batch else None
+
+    async def run_writer(self):
+        """Hands batches to the writer thread until cancelled, then drains."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                while self.backlog:
+                    await self.write_next(loop)
+        finally:
+            while self.backlog:
+                await self.write_next(loop)
+
+    async def write_next(self, loop):
+        records = self.take_batch()
+        try:
+            await loop.run_in_executor(self.executor, self.write, records)
+        except Exception:
+            # Keep listening, a broken batch must not stop the others
+            self.failed += len(records)
+            logger.exception('Writing %d sensor readings failed', len(records))
+
+    def close(self):
+        """Closes the writer thread's database connection and stops the thread."""
+        self.executor.submit(connections.close_all).result()
+        self.executor.shutdown()
+
+    def sites_for(self, space_ids):
+        """
+        Site id per record, -1 for unknown spaces. Runs on the writer thread.
+        Looked up for every batch, so logs follow a space moved to another site.
+        """
+        unique, inverse = np.unique(space_ids, return_inverse=True)
+        space_sites = dict(Space.objects.filter(pk__in=unique.tolist()).values_list('pk', 'site_id'))
+        return np.array([space_sites.get(space_id, -1) for space_id in unique.tolist()])[inverse]
+
+    def write(self, records):
+        """Inserts one batch in a single transaction. Runs on the writer thread."""
+        started = time.perf_counter()
+        site_ids = self.sites_for(records['space_id'])
+        # A corrupt timestamp would stay the space's latest log forever
+        now_us = time.time_ns() // 1000
+        timestamps = records['timestamp']
+        valid = (site_ids >= 0) & (timestamps >= max(now_us - int(self.max_age * 1_000_000), 0)) & (
+            timestamps <= now_us + MAX_CLOCK_SKEW_US
+        )
+        self.rejected += int((~valid).sum())
+        records, site_ids = records[valid], site_ids[valid]
+        if not len(records):
+            return 0
+        # Inserting in (space, timestamp) order keeps index updates local
+        order = np.lexsort((records['timestamp'], records['space_id']))
+        records, site_ids = records[order], site_ids[order]
+
+        space_ids = records['space_id'].astype(np.int64)
+        counts = records['occupied_count'].astype(np.int64)
+        anomalies = detector.score_many(space_ids, records['timestamp'], counts)
+        sensors = records['sensor'].tolist()
+        prefix = self.sensor_prefix
+        columns = [
+            site_ids.tolist(),
+            space_ids.tolist(),
+            [f'{prefix}{sensor}' if sensor else '' for sensor in sensors],
+            db_timestamps(records['timestamp']),
+            counts.tolist(),
+            nullable(records['temperature']),
+            nullable(records['pressure']),
+            nullable(records['precipitation']),
+            records['traffic_index'].tolist(),
+            (records['flags'] & 1).astype(bool).tolist(),
+            anomalies.tolist(),
+        ]
+
+        # Multi-row INSERTs of as many rows as the backend takes parameters
+        rows_per_statement = max(1, (connection.features.max_query_params or 10000) // len(columns))
+        params = np.empty((len(records), len(columns)), dtype=object)
+        for i, column in enumerate(columns):
+            params[:, i] = column
+        full = len(records) - len(records) % rows_per_statement
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if full:
+                    cursor.executemany(
+                        insert_sql(rows_per_statement),
+                        params[:full].reshape(-1, rows_per_statement * len(columns)).tolist(),
+                    )
+                if full < len(records):
+                    cursor.execute(insert_sql(len(records) - full), params[full:].ravel().tolist())
+
+        # Raw inserts send no signals
+        for site_id in set(site_ids.tolist()):
+            bump_data_version('logs', site_id)
+        self.written += len(records)
+        self.batches += 1
+        self.write_seconds += time.perf_counter() - started
+        return len(records)
+
+    def metrics(self):
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'written': self.written,
+            'failed': self.failed,
+            'backlog': self.backlog,
+            'batches': self.batches,
+            'write_seconds': round(self.write_seconds, 3),
+        }
+
+
+class SensorStreamProtocol(asyncio.Protocol):
+    """TCP: a continuous stream of records, split at any byte offset."""
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.listener.transports.add(transport)
+        if self.listener.paused:
+            transport.pause_reading()
+
+    def connection_lost(self, exc):
+        self.listener.transports.discard(self.transport)
+
+    def data_received(self, data):
+        self.buffer += data
+        whole = len(self.buffer) - len(self.buffer) % RECORD_SIZE
+        if whole:
+            self.listener.accept(decode_records(bytes(self.buffer[:whole])))
+            del self.buffer[:whole]
+
+
+class SensorDatagramProtocol(asyncio.DatagramProtocol):
+    """UDP: each datagram holds whole records, trailing bytes are dropped."""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        self.listener.accept(decode_records(data))
+
+
+async def serve(listener, host, port, udp=False):
+    """Starts the TCP server (and a UDP endpoint on the same port) plus the writer."""
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: SensorStreamProtocol(listener), host, port)
+    port = server.sockets[0].getsockname()[1]
+    endpoint = None
+    if udp:
+        endpoint, _ = await loop.create_datagram_endpoint(
+            lambda: SensorDatagramProtocol(listener), local_addr=(host, port)
+        )
+    writer = asyncio.create_task(listener.run_writer())
+    return server, endpoint, writer, port
@@ -0,0 +1,207 @@
+"""
+Self-contained load harness behind the `loadtest` management command.
+
+Simulated members browse the site and book spaces over real HTTP using a
+small asyncio client, while simulated door-counter sensors write
+OccupancyLog rows at a fixed rate. Everything runs in one process against
+either an in-process WSGI server or a given base URL.
+"""
+import asyncio
+import datetime
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.utils import timezone
+
+from .models import OccupancyLog
+
+CSRF_FIELD = re.compile(rb'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """Serves the project on a free local port from a daemon thread."""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+    server.daemon_threads = True
+    server.set_app(get_internal_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class LatencyStats:
+    """Per-endpoint latency samples and error counts."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, ok):
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        """Rows of endpoint, requests, errors, error %, req/s and p50/p90/p99/max in ms."""
+        rows = []
+        for endpoint in sorted(self.latencies):
+            samples = np.asarray(self.latencies[endpoint]) * 1000
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            errors = self.errors[endpoint]
+            rows.append({
+                'endpoint': endpoint,
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': errors / len(samples) * 100,
+                'throughput': len(samples) / elapsed,
+                'p50': p50, 'p90': p90, 'p99': p99, 'max': samples.max(),
+            })
+        return rows
+
+
+class HttpClient:
+    """
+    Minimal HTTP/1.1 client on asyncio streams with a cookie jar, one
+    connection per request so no third-party client is needed.
+    """
+
+    def __init__(self, base_url, cookies=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.cookies = dict(cookies or {})
+
+    async def request(self, method, path, form=None):
+        body = urlencode(form).encode() if form is not None else b''
+        headers = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: close',
+            f'Content-Length: {len(body)}',
+        ]
+        if form is not None:
+            headers.append('Content-Type: application/x-www-form-urlencoded')
+            # CSRF checks on plain HTTP still compare the origin
+            headers.append(f'Origin: http://{self.host}:{self.port}')
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join(f'{name}={value}' for name, value in self.cookies.items()))
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+
+        head, _, content = response.partition(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            if name.lower() == 'set-cookie':
+                cookie_name, _, cookie_value = value.strip().split(';', 1)[0].partition('=')
+                self.cookies[cookie_name] = cookie_value
+        return int(status_line.split()[1]), content
+
+
+async def timed(stats, endpoint, call, expected=(200,)):
+    started = time.perf_counter()
+    try:
+        status, content = await call
+    except OSError:
+        stats.record(endpoint, time.perf_counter() - started, ok=False)
+        return None
+    stats.record(endpoint, time.perf_counter() - started, ok=status in expected)
+    return content
+
+
+async def simulate_member(client, spaces, stats, stop_at, book_probability, think_time):
+    """Browses a site's list and a detail page, sometimes books the space."""
+    while time.monotonic() < stop_at:
+        space_id, _, site_id = random.choice(spaces)
+        await timed(stats, 'space_list', client.request('GET', f'/sites/{site_id}/'))
+        await timed(stats, 'space_detail', client.request('GET', f'/space/{space_id}/'))
+
+        if random.random() < book_probability:
+            page = await timed(stats, 'booking_form', client.request('GET', f'/space/{space_id}/book/'))
+            token = CSRF_FIELD.search(page or b'')
+            if token:
+                start = datetime.datetime.now() + datetime.timedelta(days=random.randint(1, 30), hours=random.randint(0, 12))
+                form = {
+                    'csrfmiddlewaretoken': token.group(1).decode(),
+                    'start_time': start.strftime('%Y-%m-%dT%H:00'),
+                    'end_time': (start + datetime.timedelta(hours=random.randint(1, 4))).strftime('%Y-%m-%dT%H:00'),
+                    'repeat': 'none',
+                }
+                # A valid booking redirects to the booking list
+                await timed(stats, 'book_space', client.request('POST', f'/space/{space_id}/book/', form), expected=(302,))
+
+        await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+
+def sensor_reading(space_id, capacity, site_id, sensor_id):
+    return {
+        'space_id': space_id,
+        'site_id': site_id,
+        'sensor_id': sensor_id,
+        'timestamp': timezone.now(),
+        'occupied_count': random.randint(0, capacity),
+        'temperature': 22.0 + random.uniform(-5, 5),
+        'pressure': 760 + random.uniform(-10, 10),
+        'traffic_index': random.randint(0, 10),
+    }
+
+
+def write_reading(reading):
+    OccupancyLog.objects.create(**reading)
+
+
+async def simulate_sensor(space_id, capacity, site_id, sensor_id, stats, stop_at, rate, buffer=None):
+    """
+    Sends one reading every 1/rate seconds, like a door counter: straight
+    to the database, or into `buffer` (an IngestBuffer) when given.
+    """
+    interval = 1 / rate
+    write = buffer.add_many if buffer else write_reading
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        reading = sensor_reading(space_id, capacity, site_id, sensor_id)
+        try:
+            await asyncio.to_thread(write, [reading] if buffer else reading)
+            ok = True
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        stats.record('sensor_write', elapsed, ok)
+        await asyncio.sleep(max(0.0, interval - elapsed))
+
+
+async def run_load(base_url, spaces, member_cookies, sensor_ids, sensor_rate, duration, book_probability, think_time,
+                   buffer=None):
+    """
+    Runs members and sensors for `duration` seconds. `spaces` is a list of
+    (id, capacity, site id), `member_cookies` one cookie dict per member and
+    `sensor_ids` one id per simulated sensor. Returns (stats, elapsed seconds).
+    """
+    stats = LatencyStats()
+    started = time.monotonic()
+    stop_at = started + duration
+    tasks = [
+        simulate_member(HttpClient(base_url, cookies), spaces, stats, stop_at, book_probability, think_time)
+        for cookies in member_cookies
+    ]
+    tasks += [
+        simulate_sensor(*spaces[i % len(spaces)], sensor_id, stats, stop_at, sensor_rate, buffer)
+        for i, sensor_id in enumerate(sensor_ids)
+    ]
+    await asyncio.gather(*tasks)
+    return stats, time.monotonic() - started
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.bookings import complete_expired_bookings
+from core.timeline import store_timelines
+
+
+class Command(BaseCommand):
+    help = (
+        'Marks confirmed bookings whose end time has passed as completed, in chunked bulk updates, '
+        'then stores the current booking timeline window of every space.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Bookings updated per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between chunks.')
+        parser.add_argument('--interval', type=float, help='Keep running, repeating the job every N seconds.')
+
+    def handle(self, *args, **options):
+        def report(updated, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  completed {updated} (total {total})')
+
+        while True:
+            started = time.perf_counter()
+            total = complete_expired_bookings(
+                chunk_size=options['chunk_size'], pause=options['pause'], on_chunk=report
+            )
+            # Pages shift stale timelines in memory; storing them keeps reads to one query
+            stored = store_timelines()
+            self.stdout.write(self.style.SUCCESS(
+                f'Completed {total} expired bookings and stored {stored} timelines '
+                f'in {time.perf_counter() - started:.2f}s.'
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
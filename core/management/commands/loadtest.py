@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ingest import IngestBuffer
+from core.loadtest import run_load, start_server
+from core.models import Space, OccupancyLog
+
+USERNAME_PREFIX = 'loadtest_'
+
+
+def member_session(user):
+    """Logs `user` in server-side and returns the matching cookie jar."""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return {settings.SESSION_COOKIE_NAME: session.session_key}
+
+
+class Command(BaseCommand):
+    help = (
+        'Local load test: simulated members browse and book over HTTP while simulated sensors '
+        'write occupancy logs. Reports latency percentiles, throughput and error rates per endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run.')
+        parser.add_argument('--members', type=int, default=10, help='Concurrent simulated members.')
+        parser.add_argument('--sensors', type=int, default=5, help='Simulated door-counter sensors.')
+        parser.add_argument('--sensor-rate', type=float, default=1.0, help='Readings per second per sensor.')
+        parser.add_argument('--book-probability', type=float, default=0.2, help='Chance a visit ends in a booking.')
+        parser.add_argument('--think-time', type=float, default=0.5, help='Mean pause between member visits (s).')
+        parser.add_argument('--buffered', action='store_true', help='Send sensor readings through the write-behind IngestBuffer.')
+        parser.add_argument('--url', help='Base URL of a running server sharing this database (default: start one in-process).')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the users, bookings and logs created by the run.')
+
+    def handle(self, *args, **options):
+        spaces = list(Space.objects.values_list('pk', 'capacity', 'site_id'))
+        if not spaces:
+            raise CommandError('No spaces to load test, seed the database first.')
+
+        run_id = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(f'{USERNAME_PREFIX}{run_id}_{i}')
+            for i in range(options['members'])
+        ]
+        member_cookies = [member_session(user) for user in users]
+        sensor_prefix = f'{USERNAME_PREFIX}{run_id}_'
+        sensor_ids = [f'{sensor_prefix}{i}' for i in range(options['sensors'])]
+        buffer = None
+        if options['buffered']:
+            buffer = IngestBuffer()
+            buffer.start()
+
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server, base_url = start_server()
+        self.stdout.write(
+            f"Load testing {base_url} for {options['duration']:g}s: {options['members']} members, "
+            f"{options['sensors']} sensors at {options['sensor_rate']:g}/s"
+        )
+
+        try:
+            stats, elapsed = asyncio.run(run_load(
+                base_url, spaces, member_cookies, sensor_ids, options['sensor_rate'],
+                options['duration'], options['book_probability'], options['think_time'], buffer,
+            ))
+        finally:
+            if buffer:
+                buffer.stop()
+                self.stdout.write(f'Ingest buffer: {buffer.metrics()}')
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(
+            f"{'Endpoint':<14} {'Requests':>8} {'Errors':>6} {'Err %':>6} {'Req/s':>7} "
+            f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for row in stats.report(elapsed):
+            self.stdout.write(
+                f"{row['endpoint']:<14} {row['requests']:>8} {row['errors']:>6} {row['error_rate']:>6.1f} "
+                f"{row['throughput']:>7.1f} {row['p50']:>8.1f} {row['p90']:>8.1f} {row['p99']:>8.1f} {row['max']:>8.1f}"
+            )
+
+        if not options['keep_data']:
+            # Bookings and sessions of the simulated members go with them
+            OccupancyLog.objects.filter(sensor_id__startswith=sensor_prefix).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            SessionStore.get_model_class().objects.filter(
+                session_key__in=[cookies[settings.SESSION_COOKIE_NAME] for cookies in member_cookies]
+            ).delete()
+        self.stdout.write(self.style.SUCCESS(f'Load test finished in {elapsed:.1f}s.'))
@@ -0,0 +1,132 @@
+import asyncio
+import signal
+import time
+import uuid
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.listener import RECORD_SIZE, SensorListener, encode_records, serve
+from core.models import OccupancyLog, Space
+from core.utils import bump_data_version
+
+BENCHMARK_PREFIX = 'bench_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Long-running asyncio listener for binary sensor records over TCP (and UDP with --udp), '
+        'written to occupancy logs in batched inserts. --benchmark N streams N synthetic records '
+        'through a local listener and reports the sustained ingest rate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help='Address to listen on.')
+        parser.add_argument('--port', type=int, default=9300, help='TCP (and UDP) port.')
+        parser.add_argument('--udp', action='store_true', help='Also accept records in UDP datagrams.')
+        parser.add_argument('--max-batch', type=int, default=20000, help='Rows per INSERT transaction.')
+        parser.add_argument('--max-delay', type=float, default=0.5, help='Seconds before a partial batch is written.')
+        parser.add_argument('--sensor-prefix', default='', help='Prefix of the stored sensor ids.')
+        parser.add_argument('--max-age', type=float, default=24 * 60 * 60, help='Seconds after which readings are rejected as stale.')
+        parser.add_argument('--benchmark', type=int, metavar='N', help='Stream N synthetic records and report the rate.')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the logs written by --benchmark.')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(options)
+            return
+
+        listener = SensorListener(
+            max_batch=options['max_batch'], max_delay=options['max_delay'], sensor_prefix=options['sensor_prefix'],
+            max_age=options['max_age'],
+        )
+
+        async def run():
+            server, endpoint, writer, port = await serve(listener, options['host'], options['port'], options['udp'])
+            self.stdout.write(
+                f"Listening on {options['host']}:{port} ({'TCP+UDP' if endpoint else 'TCP'}), "
+                f"{RECORD_SIZE}-byte records"
+            )
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), 60)
+                except asyncio.TimeoutError:
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{listener.metrics()}')
+            server.close()
+            if endpoint:
+                endpoint.close()
+            # Cancelling the writer flushes what is still pending
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+        try:
+            asyncio.run(run())
+        finally:
+            listener.close()
+        self.stdout.write(self.style.SUCCESS(f'Listener stopped: {listener.metrics()}'))
+
+    def benchmark(self, options):
+        space_ids = list(Space.objects.values_list('pk', flat=True))
+        if not space_ids:
+            raise CommandError('No spaces to benchmark, seed the database first.')
+        total = options['benchmark']
+        prefix = f'{BENCHMARK_PREFIX}{uuid.uuid4().hex[:8]}_'
+        listener = SensorListener(max_batch=options['max_batch'], max_delay=options['max_delay'], sensor_prefix=prefix)
+
+        # Readings one second apart per sensor, ending now
+        rng = np.random.default_rng()
+        sensors = np.arange(total) % 1000 + 1
+        now_us = int(timezone.now().timestamp() * 1_000_000)
+        payload = encode_records(
+            np.asarray(space_ids)[sensors % len(space_ids)],
+            now_us - (total - np.arange(total)) // 1000 * 1_000_000,
+            rng.integers(0, 20, total),
+            sensors=sensors,
+            temperature=rng.normal(22, 2, total),
+            pressure=rng.normal(760, 5, total),
+            traffic_index=rng.integers(0, 11, total),
+        )
+        self.stdout.write(f'Benchmarking {total} records ({len(payload) / 1e6:.1f} MB) over local TCP')
+
+        async def run():
+            server, _, writer, port = await serve(listener, '127.0.0.1', 0)
+            started = time.perf_counter()
+            _, stream = await asyncio.open_connection('127.0.0.1', port)
+            for offset in range(0, len(payload), 1 << 16):
+                stream.write(payload[offset:offset + (1 << 16)])
+                await stream.drain()
+            stream.close()
+            while listener.written + listener.rejected + listener.failed < total:
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - started
+            server.close()
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            return elapsed
+
+        try:
+            elapsed = asyncio.run(run())
+        finally:
+            listener.close()
+
+        metrics = listener.metrics()
+        self.stdout.write(f'Metrics: {metrics}')
+        self.stdout.write(
+            f"Ingested {metrics['written']} readings in {elapsed:.2f}s: {metrics['written'] / elapsed:,.0f} readings/s "
+            f"end to end, {metrics['written'] / max(metrics['write_seconds'], 1e-9):,.0f} readings/s in the writer "
+            f"({metrics['batches']} batches)"
+        )
+        if not options['keep_data']:
+            logs = OccupancyLog.objects.filter(sensor_id__startswith=prefix)
+            site_ids = set(Space.objects.filter(pk__in=space_ids).values_list('site_id', flat=True))
+            # One DELETE instead of loading every row to send delete signals
+            logs._raw_delete(logs.db)
+            for site_id in site_ids:
+                bump_data_version('logs', site_id)
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
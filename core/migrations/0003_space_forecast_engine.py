@@ -0,0 +1,25 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_occupancylog_precipitation_occupancylog_pressure_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="space",
+            name="forecast_engine",
+            field=models.CharField(
+                choices=[
+                    ("median", "Weekday/hour median"),
+                    ("linear", "Weather-aware linear"),
+                ],
+                default="median",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_space_forecast_engine"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="occupancylog",
+            index=models.Index(
+                fields=["space", "timestamp"], name="core_occupa_space_i_9f8424_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_occupancylog_space_timestamp_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["status", "end_time"], name="core_bookin_status_571cd1_idx"
+            ),
+        ),
+    ]
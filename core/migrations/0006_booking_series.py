@@ -0,0 +1,20 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_booking_status_end_time_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="series",
+            field=models.UUIDField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_booking_series"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="occupancylog",
+            name="sensor_id",
+            field=models.CharField(blank=True, default="", max_length=50),
+        ),
+        migrations.AlterField(
+            model_name="occupancylog",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name="occupancylog",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("sensor_id", ""), _negated=True),
+                fields=("space", "sensor_id", "timestamp"),
+                name="unique_sensor_reading",
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_occupancylog_sensor_reading"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OccupancyTimeline",
+            fields=[
+                (
+                    "space",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="timeline",
+                        serialize=False,
+                        to="core.space",
+                    ),
+                ),
+                ("start", models.DateTimeField()),
+                ("counts", models.BinaryField()),
+            ],
+        ),
+    ]
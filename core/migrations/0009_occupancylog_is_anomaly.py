@@ -0,0 +1,63 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:31
+
+from collections import deque
+
+import numpy as np
+from django.db import migrations, models
+
+# The detector's settings when the flag was added, kept here so later
+# changes to core.anomaly never change what this migration does
+WINDOW = 50
+MIN_SAMPLES = 10
+THRESHOLD = 3.5
+MIN_SCALE = 1.0
+
+
+def flag_existing_logs(apps, schema_editor):
+    """
+    Scores the logs stored before the flag existed, like flag_anomalies,
+    so graphs and forecasts keep filtering historical outliers. Every
+    reading is compared with the previous WINDOW readings of its space,
+    hour of day and kind of day using a modified z-score.
+    """
+    OccupancyLog = apps.get_model("core", "OccupancyLog")
+    for space_id in apps.get_model("core", "Space").objects.order_by("pk").values_list("pk", flat=True):
+        windows = {}
+        flagged = []
+        logs = OccupancyLog.objects.filter(space_id=space_id).order_by("timestamp", "pk")
+        for pk, timestamp, count in logs.values_list("pk", "timestamp", "occupied_count").iterator(chunk_size=5000):
+            window = windows.setdefault((timestamp.weekday() >= 5, timestamp.hour), deque(maxlen=WINDOW))
+            if len(window) >= MIN_SAMPLES:
+                values = np.fromiter(window, dtype=float, count=len(window))
+                median = np.median(values)
+                scale = max(1.4826 * np.median(np.abs(values - median)), MIN_SCALE)
+                if abs(count - median) / scale > THRESHOLD:
+                    flagged.append(pk)
+            window.append(count)
+        # The new column defaults to False, only anomalies need writing
+        for start in range(0, len(flagged), 500):
+            OccupancyLog.objects.filter(pk__in=flagged[start:start + 500]).update(is_anomaly=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_occupancytimeline"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="occupancylog",
+            name="is_anomaly",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="occupancylog",
+            index=models.Index(
+                condition=models.Q(("is_anomaly", False)),
+                fields=["space", "timestamp"],
+                name="occupancylog_normal_idx",
+            ),
+        ),
+        migrations.RunPython(flag_existing_logs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,125 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def assign_default_site(apps, schema_editor):
+    """Puts existing spaces into one site and copies it to their bookings and logs."""
+    Site = apps.get_model("core", "Site")
+    Space = apps.get_model("core", "Space")
+    Booking = apps.get_model("core", "Booking")
+    OccupancyLog = apps.get_model("core", "OccupancyLog")
+    if not Space.objects.exists():
+        return
+    site = Site.objects.create(name="Main", slug="main")
+    Space.objects.update(site=site)
+    space_site = Space.objects.filter(pk=OuterRef("space_id")).values("site_id")[:1]
+    Booking.objects.update(site_id=Subquery(space_site))
+    OccupancyLog.objects.update(site_id=Subquery(space_site))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_occupancylog_is_anomaly"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Site",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("slug", models.SlugField(unique=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="space",
+            name="site",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="spaces",
+                to="core.site",
+            ),
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="site",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.site",
+            ),
+        ),
+        migrations.AddField(
+            model_name="occupancylog",
+            name="site",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.site",
+            ),
+        ),
+        migrations.RunPython(assign_default_site, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="space",
+            name="site",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="spaces",
+                to="core.site",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="booking",
+            name="site",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.site",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="occupancylog",
+            name="site",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.site",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["site", "start_time"], name="core_bookin_site_id_0bfe7b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="occupancylog",
+            index=models.Index(
+                fields=["site", "timestamp"], name="core_occupa_site_id_10a5c4_idx"
+            ),
+        ),
+    ]
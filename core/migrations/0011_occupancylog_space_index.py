@@ -0,0 +1,24 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_site"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="occupancylog",
+            name="space",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="occupancy_logs",
+                to="core.space",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-19 17:52
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_occupancylog_space_index"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="booking",
+            name="core_bookin_site_id_0bfe7b_idx",
+        ),
+        migrations.AddField(
+            model_name="site",
+            name="closes_at",
+            field=models.TimeField(default=datetime.time(22, 0)),
+        ),
+        migrations.AddField(
+            model_name="site",
+            name="opens_at",
+            field=models.TimeField(default=datetime.time(8, 0)),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["site", "end_time"], name="core_bookin_site_id_e83dd4_idx"
+            ),
+        ),
+    ]
@@ -1,5 +1,8 @@
+import datetime
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Amenity(models.Model):
     name = models.CharField(max_length=50)
@@ -10,12 +13,30 @@ class Amenity(models.Model):
     class Meta:
         verbose_name_plural = "Amenities"
 
+class Site(models.Model):
+    """A coworking location; spaces, bookings and logs are scoped to one site."""
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(unique=True)
+    # Daily opening hours, the denominator of utilization reports
+    opens_at = models.TimeField(default=datetime.time(8))
+    closes_at = models.TimeField(default=datetime.time(22))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
 class Space(models.Model):
+    FORECAST_ENGINE_CHOICES = [
+        ('median', 'Weekday/hour median'),
+        ('linear', 'Weather-aware linear'),
+    ]
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='spaces')
     name = models.CharField(max_length=100)
     capacity = models.IntegerField()
     description = models.TextField()
     price_per_hour = models.DecimalField(max_digits=6, decimal_places=2)
     amenities = models.ManyToManyField(Amenity, blank=True)
+    forecast_engine = models.CharField(max_length=20, choices=FORECAST_ENGINE_CHOICES, default='median')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -29,17 +50,35 @@ class Booking(models.Model):
     ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
     space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name='bookings')
+    # Copied from the space on save, leads the per-site indexes
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='+', editable=False, db_index=False)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='confirmed')
+    # Shared by all occurrences of a recurring booking
+    series = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Lifecycle job: confirmed bookings by end time
+            models.Index(fields=['status', 'end_time']),
+            # Per-site reports: bookings overlapping a window, found by end time
+            models.Index(fields=['site', 'end_time']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.space.name} ({self.start_time})"
 
 class OccupancyLog(models.Model):
-    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name='occupancy_logs')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Covered by the (space, timestamp) index, a separate one only slows ingest
+    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name='occupancy_logs', db_index=False)
+    # Copied from the space on save, leads the per-site indexes
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='+', editable=False, db_index=False)
+    # Sensors report their own reading time, so it is not auto_now_add
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Empty for manual entries
+    sensor_id = models.CharField(max_length=50, blank=True, default='')
     occupied_count = models.IntegerField()
     # Weather factors
     temperature = models.FloatField(null=True, blank=True) # Celsius
@@ -48,7 +87,45 @@ class OccupancyLog(models.Model):
     # External factors
     traffic_index = models.IntegerField(default=0, help_text="0-10 scale")
     is_holiday = models.BooleanField(default=False)
+    # Set on ingest by core/anomaly.py
+    is_anomaly = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Latest-log and per-space window lookups
+            models.Index(fields=['space', 'timestamp']),
+            # Per-site scans by time
+            models.Index(fields=['site', 'timestamp']),
+            # Same lookups restricted to readings that are not anomalies
+            models.Index(
+                fields=['space', 'timestamp'],
+                condition=models.Q(is_anomaly=False),
+                name='occupancylog_normal_idx',
+            ),
+        ]
+        constraints = [
+            # Idempotency key for sensor readings, retries are ignored on insert
+            models.UniqueConstraint(
+                fields=['space', 'sensor_id', 'timestamp'],
+                condition=~models.Q(sensor_id=''),
+                name='unique_sensor_reading',
+            ),
+        ]
 
     def __str__(self):
         temp_str = f"{self.temperature:.1f}°C" if self.temperature is not None else "N/A"
         return f"{self.space.name} @ {self.timestamp.strftime('%Y-%m-%d %H:%M')} | Occ: {self.occupied_count} | Temp: {temp_str}"
+
+
+class OccupancyTimeline(models.Model):
+    """
+    Confirmed bookings per 15-minute slot for the next days, derived from
+    Booking and kept up to date by core/timeline.py.
+    """
+    space = models.OneToOneField(Space, on_delete=models.CASCADE, primary_key=True, related_name='timeline')
+    start = models.DateTimeField()
+    # uint16 count per slot from `start`
+    counts = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.space.name} timeline from {self.start:%Y-%m-%d %H:%M}"
@@ -0,0 +1,255 @@
+"""
+Utilization and revenue reports per space, by day or week.
+
+For every period the report holds booked seat-hours, utilization (booked
+hours over capacity x opening hours), revenue at the space's current
+price_per_hour and the mean measured occupancy of normal readings. All
+per-row work happens in grouped SQL aggregates: bookings are clipped to
+the report window and summed per (space, start period, end period), so a
+booking that spans several periods is split exactly without fetching
+it, and readings are averaged per (space, period). Periods are UTC days
+and weeks starting on Monday, like the anomaly windows, so every period
+has a fixed length in seconds and its index is computed in SQL. Periods
+that have ended are cached individually, so a report over the last year
+only recomputes the days that are not cached yet.
+"""
+import base64
+import datetime
+from io import BytesIO
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Avg, BigIntegerField, Count, F, Func, Sum, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import Booking, OccupancyLog, Space
+
+matplotlib.use('Agg')
+
+PERIOD_SECONDS = {'day': 24 * 60 * 60, 'week': 7 * 24 * 60 * 60}
+PERIOD_KINDS = tuple(PERIOD_SECONDS)
+# Bookings that took or will take place
+BOOKED_STATUSES = ('confirmed', 'completed')
+# Ended periods are immutable enough to keep; edits to the past show up
+# once their entry expires
+CACHE_SECONDS = 24 * 60 * 60
+
+
+class EpochSeconds(Func):
+    """
+    Whole seconds since the Unix epoch of a datetime column, computed by the
+    database itself. Django's own datetime functions run in Python on
+    SQLite, which is too slow over a year of bookings.
+    """
+    template = 'CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)'
+    output_field = BigIntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Datetimes are stored as UTC text; '%%%%s' reaches SQLite as '%s'
+        return self.as_sql(
+            compiler, connection, template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)", **extra_context
+        )
+
+
+def period_starts(kind, count, now=None):
+    """Starts of the last `count` periods up to and including the current one, plus the next start."""
+    today = (now or timezone.now()).astimezone(datetime.timezone.utc).date()
+    if kind == 'week':
+        today -= datetime.timedelta(days=today.weekday())
+    step = datetime.timedelta(seconds=PERIOD_SECONDS[kind])
+    first = datetime.datetime.combine(today, datetime.time(), datetime.timezone.utc) - step * (count - 1)
+    return [first + step * i for i in range(count + 1)]
+
+
+def booked_seconds(site_id, kind, bounds):
+    """
+    {(space_id, period start): booked seconds} for the periods delimited by
+    `bounds`, from one grouped query over bookings overlapping the window.
+    """
+    length = PERIOD_SECONDS[kind]
+    origin, end = int(bounds[0].timestamp()), int(bounds[-1].timestamp())
+    # Seconds from the window start, clipped to the window
+    clipped_start = Greatest(EpochSeconds('start_time'), Value(origin)) - Value(origin)
+    clipped_end = Least(EpochSeconds('end_time'), Value(end)) - Value(origin)
+    groups = Booking.objects.filter(
+        site_id=site_id, status__in=BOOKED_STATUSES, end_time__gt=bounds[0], start_time__lt=bounds[-1],
+    ).annotate(
+        # Grouping on an expression keeps SQLite from scanning the whole
+        # space_id index to avoid a sort, instead of the (site, end_time) range
+        space_key=F('space_id') + Value(0),
+        # Integer division of non-negative offsets is the period index
+        first=clipped_start / Value(length),
+        last=clipped_end / Value(length),
+    ).values('space_key', 'first', 'last').annotate(
+        bookings=Count('pk'), starts=Sum(clipped_start), ends=Sum(clipped_end),
+    ).order_by()
+
+    periods = len(bounds) - 1
+    seconds = {}
+    for row in groups:
+        space_id, first, last, n = row['space_key'], row['first'], min(row['last'], periods), row['bookings']
+        if first == last:
+            parts = {first: row['ends'] - row['starts']}
+        else:
+            # Start period up to its end, full periods between, end period from its start
+            parts = {first: n * (first + 1) * length - row['starts']}
+            for middle in range(first + 1, last):
+                parts[middle] = n * length
+            if last < periods:
+                parts[last] = row['ends'] - n * last * length
+        for i, value in parts.items():
+            key = (space_id, bounds[i])
+            seconds[key] = seconds.get(key, 0) + value
+    return seconds
+
+
+def occupancy_means(site_id, kind, bounds):
+    """
+    {(space_id, period start): (mean occupied_count, readings)} of the
+    normal logs in the periods delimited by `bounds`, from one grouped query.
+    """
+    origin = int(bounds[0].timestamp())
+    rows = OccupancyLog.objects.filter(
+        site_id=site_id, is_anomaly=False, timestamp__gte=bounds[0], timestamp__lt=bounds[-1],
+    ).annotate(
+        period=(EpochSeconds('timestamp') - Value(origin)) / Value(PERIOD_SECONDS[kind]),
+    ).values('space_id', 'period').annotate(mean=Avg('occupied_count'), readings=Count('pk')).order_by()
+    return {(row['space_id'], bounds[row['period']]): (row['mean'], row['readings']) for row in rows}
+
+
+def period_cache_key(site_id, kind, period_start):
+    return f'utilization:{site_id}:{kind}:{period_start.isoformat()}'
+
+
+def period_stats(site_id, kind, bounds, now=None):
+    """
+    Per-period {space_id: (booked seconds, mean occupancy, readings)} for
+    the periods delimited by `bounds`. Ended periods come from the cache
+    when possible; the rest are computed together and the ended ones stored.
+    """
+    now = now or timezone.now()
+    periods = bounds[:-1]
+    keys = [period_cache_key(site_id, kind, start) for start in periods]
+    cached = cache.get_many(keys)
+    stats = [cached.get(key) for key in keys]
+    missing = [i for i, value in enumerate(stats) if value is None]
+    if not missing:
+        return stats
+
+    window = bounds[missing[0]:missing[-1] + 2]
+    seconds = booked_seconds(site_id, kind, window)
+    means = occupancy_means(site_id, kind, window)
+    space_ids = {}
+    for space_id, start in seconds.keys() | means.keys():
+        space_ids.setdefault(start, set()).add(space_id)
+    fresh = {}
+    for i in missing:
+        stats[i] = {
+            space_id: (seconds.get((space_id, bounds[i]), 0), *means.get((space_id, bounds[i]), (None, 0)))
+            for space_id in space_ids.get(bounds[i], ())
+        }
+        if bounds[i + 1] <= now:
+            fresh[keys[i]] = stats[i]
+    cache.set_many(fresh, CACHE_SECONDS)
+    return stats
+
+
+def utilization_report(site, kind='day', count=30, now=None):
+    """
+    Report over the last `count` periods of `kind` ('day' or 'week') for
+    every space of `site`. Returns a dict with the period starts, the
+    spaces and spaces x periods arrays of booked_hours, utilization (0-1),
+    revenue and avg_occupancy (NaN without readings), plus per-space totals.
+    """
+    bounds = period_starts(kind, count, now)
+    spaces = list(Space.objects.filter(site=site).order_by('pk'))
+    stats = period_stats(site.pk, kind, bounds, now)
+
+    position = {space.pk: i for i, space in enumerate(spaces)}
+    booked = np.zeros((len(spaces), count))
+    occupancy_sum = np.zeros((len(spaces), count))
+    readings = np.zeros((len(spaces), count))
+    for j, period in enumerate(stats):
+        for space_id, (seconds, mean, n) in period.items():
+            # Spaces deleted or moved since the period was cached
+            if space_id in position:
+                i = position[space_id]
+                booked[i, j] = seconds / 3600
+                occupancy_sum[i, j] = (mean or 0) * n
+                readings[i, j] = n
+
+    opening = datetime.datetime.combine(datetime.date.min, site.closes_at) - datetime.datetime.combine(
+        datetime.date.min, site.opens_at
+    )
+    open_hours = opening.total_seconds() / 3600 * (7 if kind == 'week' else 1)
+    capacity = np.array([space.capacity for space in spaces], dtype=float)
+    price = np.array([float(space.price_per_hour) for space in spaces])
+    seat_hours = capacity[:, None] * open_hours
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilization = np.where(seat_hours > 0, booked / seat_hours, 0.0)
+        avg_occupancy = occupancy_sum / readings
+        totals = [
+            {
+                'space': space,
+                'booked_hours': booked[i].sum(),
+                'utilization': booked[i].sum() / (seat_hours[i, 0] * count) if seat_hours[i, 0] > 0 else 0.0,
+                'revenue': booked[i].sum() * price[i],
+                'avg_occupancy': occupancy_sum[i].sum() / readings[i].sum() if readings[i].sum() else None,
+            }
+            for i, space in enumerate(spaces)
+        ]
+    return {
+        'kind': kind,
+        'periods': bounds[:-1],
+        'spaces': spaces,
+        'booked_hours': booked,
+        'utilization': utilization,
+        'revenue': booked * price[:, None],
+        'avg_occupancy': avg_occupancy,
+        'open_hours': open_hours,
+        'totals': totals,
+    }
+
+
+def generate_utilization_chart(report):
+    """
+    Utilization heatmap (spaces x periods) next to revenue against mean
+    utilization per space, as a base64 PNG. Readable with a thousand spaces.
+    """
+    spaces = report['spaces']
+    if not spaces:
+        return None
+    fig, (heat, scatter) = plt.subplots(
+        1, 2, figsize=(14, max(4, min(12, len(spaces) * 0.3))), gridspec_kw={'width_ratios': [3, 1]}
+    )
+    image = heat.imshow(
+        report['utilization'] * 100, aspect='auto', interpolation='nearest', cmap='YlOrRd', vmin=0, vmax=100
+    )
+    fig.colorbar(image, ax=heat, label='Utilization %')
+    periods = report['periods']
+    ticks = np.linspace(0, len(periods) - 1, min(len(periods), 10)).round().astype(int)
+    heat.set_xticks(ticks, [periods[i].strftime('%m-%d') for i in ticks], rotation=45)
+    if len(spaces) <= 40:
+        heat.set_yticks(range(len(spaces)), [space.name for space in spaces])
+    else:
+        heat.set_ylabel(f'{len(spaces)} spaces')
+    heat.set_title(f"Utilization per {report['kind']}")
+
+    totals = report['totals']
+    scatter.scatter(
+        [row['utilization'] * 100 for row in totals], [row['revenue'] for row in totals],
+        s=12 if len(spaces) > 40 else 30, alpha=0.7,
+    )
+    scatter.set_xlabel('Mean utilization %')
+    scatter.set_ylabel('Revenue')
+    scatter.set_title('Revenue vs utilization')
+    scatter.grid(True)
+    fig.tight_layout()
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
@@ -0,0 +1,100 @@
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .anomaly import detector
+from .models import Amenity, Booking, OccupancyLog, Site, Space
+from .timeline import apply_booking_changes
+from .utils import bump_data_version
+
+
+@receiver(pre_save, sender=Booking)
+@receiver(pre_save, sender=OccupancyLog)
+def copy_space_site(sender, instance, raw=False, **kwargs):
+    # Bookings can be moved to another space, logs never are
+    if not raw and (instance.site_id is None or sender is Booking):
+        instance.site_id = instance.space.site_id
+
+
+@receiver(pre_save, sender=OccupancyLog)
+def flag_anomaly(sender, instance, raw=False, **kwargs):
+    # Fixtures keep their stored flag, edits are not rescored
+    if instance._state.adding and not raw:
+        instance.is_anomaly = detector.score(instance.space_id, instance.timestamp, instance.occupied_count)
+
+
+@receiver([post_save, post_delete], sender=OccupancyLog)
+def occupancy_log_changed(sender, instance, **kwargs):
+    bump_data_version('logs', instance.site_id)
+
+
+def timeline_slot(booking):
+    """(space_id, start, end) a booking occupies on the timeline, if any."""
+    if booking.status != 'confirmed' or booking.start_time is None or booking.end_time is None:
+        return None
+    return (booking.space_id, booking.start_time, booking.end_time)
+
+
+@receiver(post_init, sender=Booking)
+def remember_booking_slot(sender, instance, **kwargs):
+    instance._timeline_slot = timeline_slot(instance)
+    instance._site_id = instance.site_id
+
+
+def deleting_space(origin):
+    """Whether a delete started at `origin` removes spaces, and their timelines with them."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Space, Site)
+
+
+@receiver([post_save, post_delete], sender=Booking)
+def booking_changed(sender, instance, signal, created=False, origin=None, **kwargs):
+    # A new booking's constructor values were never on the timeline
+    old = None if created else instance._timeline_slot
+    new = timeline_slot(instance) if signal is post_save else None
+    # Patching would store a timeline again for a space about to be deleted
+    if old != new and not deleting_space(origin):
+        # Edits can move a booking between spaces
+        for space_id in {slot[0] for slot in (old, new) if slot}:
+            apply_booking_changes(
+                space_id,
+                removed=[old[1:]] if old and old[0] == space_id else [],
+                added=[new[1:]] if new and new[0] == space_id else [],
+            )
+        instance._timeline_slot = new
+    for site_id in {instance._site_id, instance.site_id} - {None}:
+        bump_data_version('bookings', site_id)
+    instance._site_id = instance.site_id
+
+
+@receiver(post_init, sender=Space)
+def remember_space_site(sender, instance, **kwargs):
+    instance._site_id = instance.site_id
+
+
+def move_space_data(space):
+    """Bookings and logs follow a space moved to another site."""
+    Booking.objects.filter(space=space).update(site_id=space.site_id)
+    OccupancyLog.objects.filter(space=space).update(site_id=space.site_id)
+    for kind in ('bookings', 'logs'):
+        bump_data_version(kind, space._site_id)
+        bump_data_version(kind, space.site_id)
+
+
+@receiver([post_save, post_delete], sender=Space)
+@receiver([post_save, post_delete], sender=Site)
+@receiver([post_save, post_delete], sender=Amenity)
+@receiver(m2m_changed, sender=Space.amenities.through)
+def space_changed(sender, instance, signal, created=False, raw=False, **kwargs):
+    if isinstance(instance, Site):
+        site_ids = [instance.pk]
+    elif isinstance(instance, Space):
+        site_ids = {instance._site_id, instance.site_id} - {None}
+        if signal is post_save and not (created or raw) and len(site_ids) > 1:
+            move_space_data(instance)
+        instance._site_id = instance.site_id
+    else:
+        # Amenities are shared by every site
+        site_ids = Site.objects.values_list('pk', flat=True)
+    for site_id in site_ids:
+        bump_data_version('spaces', site_id)
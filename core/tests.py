@@ -1,3 +1,840 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .anomaly import MIN_SAMPLES, AnomalyDetector, detector
+from .backtest import backtest_space
+from .bookings import complete_expired_bookings, expand_recurrence, find_capacity_conflicts
+from .forecast import LinearForecast
+from .ingest import IngestBuffer
+from .listener import RECORD, RECORD_SIZE, SensorListener, SensorStreamProtocol, decode_records, encode_records
+from .management.commands.backtest_forecast import bounded_map
+from .reports import utilization_report
+from .timeline import TIMELINE_SLOTS, build_counts, get_timelines, refresh_timelines, store_timelines, window_start
+from .models import Site, Space, Booking, OccupancyLog, OccupancyTimeline
+from .utils import (
+    LINEAR_REFIT_SECONDS, load_space_logs, recent_logs_from, generate_sparklines, fit_linear_forecast, data_version,
+    generate_occupancy_graph, generate_prediction_graph, generate_correlation_graph,
+)
+
+
+# The suite clears and fills caches, keep it away from the live cache files
+CACHE_DIR = tempfile.TemporaryDirectory()
+TEST_CACHES = {
+    alias: {**config, 'LOCATION': os.path.join(CACHE_DIR.name, alias)} for alias, config in settings.CACHES.items()
+}
+
+
+def make_space(site=None, **fields):
+    """Creates a space, at a shared default site unless `site` is given."""
+    site = site or Site.objects.get_or_create(slug='main', defaults={'name': 'Main'})[0]
+    return Space.objects.create(site=site, **fields)
+
+
+def make_logs(space, count, end=None, step=datetime.timedelta(hours=1)):
+    """Creates `count` logs `step` apart, the last one at `end`."""
+    end = end or timezone.now()
+    return OccupancyLog.objects.bulk_create([
+        OccupancyLog(
+            space=space,
+            site_id=space.site_id,
+            timestamp=end - step * (count - 1 - i),
+            occupied_count=i % (space.capacity + 1),
+            temperature=20.0 + i % 7,
+            pressure=760.0,
+            precipitation=float(i % 3),
+            traffic_index=i % 11,
+        )
+        for i in range(count)
+    ])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SpaceLogLoaderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.space = make_space(name='Open Space', capacity=20, description='Desks', price_per_hour=5)
+        make_logs(cls.space, 24 * 14)
+
+    def test_all_graphs_share_one_query(self):
+        with self.assertNumQueries(1):
+            data = load_space_logs(self.space.id)
+            self.assertIsNotNone(generate_occupancy_graph(self.space.id, window_size=3, remove_outliers=True, data=data))
+            self.assertIsNotNone(generate_prediction_graph(self.space.id, data=data))
+            self.assertIsNotNone(generate_correlation_graph(self.space.id, data=data))
+            recent = recent_logs_from(data, self.space)
+        self.assertEqual(len(recent), 5)
+        self.assertEqual(recent[0].timestamp, OccupancyLog.objects.latest('timestamp').timestamp)
+
+    def test_detail_view_query_count(self):
+        # Space lookup, amenities in the template, and the single log fetch
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('space_detail', args=[self.space.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['recent_logs']), 5)
+
+    def test_loader_peak_memory(self):
+        load_space_logs(self.space.id)  # warm up query compilation
+        tracemalloc.start()
+        data = load_space_logs(self.space.id)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertEqual(len(data), 24 * 14)
+        # Model instances alone would cost well over 1 KB per row
+        self.assertLess(peak / len(data), 1024)
+
+    def test_empty_space(self):
+        space = make_space(name='Empty', capacity=4, description='', price_per_hour=1)
+        data = load_space_logs(space.id)
+        self.assertTrue(data.empty)
+        self.assertIsNone(generate_occupancy_graph(space.id, data=data))
+        self.assertIsNone(generate_prediction_graph(space.id, data=data))
+        self.assertIsNone(generate_correlation_graph(space.id, data=data))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SparklineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.spaces = [
+            make_space(name=f'Room {i}', capacity=10, description='', price_per_hour=5)
+            for i in range(3)
+        ]
+        for space in cls.spaces[:2]:
+            make_logs(space, 48)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_batched_and_cached(self):
+        # One query for every series, the cache key comes from the site tokens
+        with self.assertNumQueries(1):
+            sparklines = generate_sparklines(self.spaces)
+        self.assertTrue(sparklines[self.spaces[0].id].startswith('M0 '))
+        self.assertEqual(sparklines[self.spaces[0].id].count('L'), 23)
+        self.assertIsNone(sparklines[self.spaces[2].id])
+        with self.assertNumQueries(0):
+            self.assertEqual(generate_sparklines(self.spaces), sparklines)
+
+    def test_new_log_invalidates_cache(self):
+        generate_sparklines(self.spaces)
+        OccupancyLog.objects.create(space=self.spaces[2], occupied_count=5)
+        sparklines = generate_sparklines(self.spaces)
+        self.assertIsNotNone(sparklines[self.spaces[2].id])
+
+    def test_logs_at_other_sites_keep_the_cache(self):
+        generate_sparklines(self.spaces)
+        elsewhere = make_space(Site.objects.create(name='Other', slug='other'), name='Far', capacity=5, description='', price_per_hour=5)
+        OccupancyLog.objects.create(space=elsewhere, occupied_count=5)
+        with self.assertNumQueries(0):
+            generate_sparklines(self.spaces)
+
+    def test_list_page_renders_sparklines(self):
+        response = self.client.get(reverse('space_list', args=[self.spaces[0].site_id]))
+        self.assertContains(response, '<path d="M0 ', count=2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BacktestTests(TestCase):
+    def test_rolling_origin_folds(self):
+        stamps = pd.date_range('2026-01-05', periods=24 * 7 * 4, freq='h', tz='UTC')
+        # Same value every weekday hour, so the median model is exact there
+        counts = np.where(stamps.dayofweek < 5, 10, 6)
+        rows = backtest_space(1, stamps.asi8, counts, min_train_weeks=1, horizon_days=7)
+        self.assertEqual([row['lead_day'] for row in rows], list(range(1, 8)))
+        self.assertTrue(all(row['folds'] == 3 for row in rows))
+        # Weekdays and weekends are 100% predictable apart from the smoothed edges
+        self.assertLess(rows[1]['mae'], 0.5)
+        self.assertEqual(backtest_space(1, np.array([], dtype=np.int64), np.array([])), [])
+
+    def test_command_with_process_pool(self):
+        for i in range(2):
+            space = make_space(name=f'Room {i}', capacity=10, description='', price_per_hour=5)
+            make_logs(space, 24 * 21)
+        for engine in ('median', 'linear'):
+            out = StringIO()
+            call_command('backtest_forecast', workers=2, engine=engine, stdout=out)
+            self.assertIn(f'Backtested 2 spaces with the {engine} engine', out.getvalue())
+            self.assertIn('ms/fold', out.getvalue())
+
+    def test_bounded_map_drains_tasks_lazily(self):
+        pulled = []
+
+        def tasks():
+            for i in range(20):
+                pulled.append(i)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = bounded_map(pool, lambda i: i * i, tasks(), 4)
+            self.assertEqual(next(results), 0)
+            # The window plus the task that made room for the first result
+            self.assertEqual(len(pulled), 5)
+            self.assertEqual(list(results), [i * i for i in range(1, 20)])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LinearForecastTests(TestCase):
+    def weather_frame(self, hours=24 * 28):
+        rng = np.random.default_rng(0)
+        stamps = pd.date_range('2026-01-05', periods=hours, freq='h', tz='UTC')
+        weather = pd.DataFrame({
+            'temperature': rng.uniform(15, 30, hours),
+            'pressure': rng.uniform(750, 770, hours),
+            'precipitation': rng.uniform(0, 10, hours),
+            'traffic_index': rng.integers(0, 11, hours),
+            'is_holiday': stamps.dayofweek >= 5,
+        })
+        counts = 10 + 4 * (stamps.hour >= 9) - 0.5 * weather['precipitation'] - 3 * weather['is_holiday']
+        return stamps, weather, np.asarray(counts)
+
+    def test_learns_weather_effects(self):
+        stamps, weather, counts = self.weather_frame()
+        model = LinearForecast(alpha=1e-3).partial_fit(stamps, weather, counts).solve()
+        np.testing.assert_allclose(model.predict(stamps, weather), counts, atol=0.05)
+
+    def test_incremental_fit_matches_batch_fit(self):
+        stamps, weather, counts = self.weather_frame()
+        batch = LinearForecast().partial_fit(stamps, weather, counts).solve()
+        incremental = LinearForecast()
+        for week in range(4):
+            rows = slice(week * 168, (week + 1) * 168)
+            incremental.partial_fit(stamps[rows], weather[rows], counts[rows]).solve()
+        np.testing.assert_allclose(incremental.coef, batch.coef)
+
+    def test_cached_refit_reads_only_new_logs(self):
+        cache.clear()
+        space = make_space(name='Desk', capacity=20, description='', price_per_hour=5, forecast_engine='linear')
+        make_logs(space, 24 * 7)
+        self.assertEqual(fit_linear_forecast(space.id).samples, 24 * 7)
+        make_logs(space, 3)
+        with self.assertNumQueries(1):
+            model = fit_linear_forecast(space.id)
+        self.assertEqual(model.samples, 24 * 7 + 3)
+        # A re-flagged log only leaves the sums once the model is rebuilt
+        OccupancyLog.objects.filter(pk=OccupancyLog.objects.filter(space=space).earliest('id').pk).update(is_anomaly=True)
+        make_logs(space, 1)
+        model = fit_linear_forecast(space.id)
+        self.assertEqual(model.samples, 24 * 7 + 4)
+        model.fitted_at -= LINEAR_REFIT_SECONDS + 1
+        cache.set(f'linear_forecast:{space.id}', model)
+        self.assertEqual(fit_linear_forecast(space.id).samples, 24 * 7 + 3)
+        response = self.client.get(reverse('space_detail', args=[space.pk]))
+        self.assertIsNotNone(response.context['prediction_image'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SpaceApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.spaces = [
+            make_space(name=f'Room {i}', capacity=10, description='', price_per_hour=5)
+            for i in range(3)
+        ]
+        make_logs(cls.spaces[0], 3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_constant_query_count(self):
+        # The complete_bookings job stores the booking timelines
+        store_timelines()
+        url = reverse('api_space_list', args=[self.spaces[0].site_id])
+        # Annotated spaces, the amenities prefetch and the timelines, however many spaces
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        payload = response.json()['spaces']
+        self.assertEqual(len(payload), 3)
+        self.assertEqual(payload[0]['current_occupancy'], 2)
+        self.assertEqual(payload[0]['occupancy_percentage'], 20)
+        self.assertEqual(payload[0]['occupancy_color'], 'green')
+        self.assertEqual(payload[1]['current_occupancy'], 0)
+
+    def test_not_modified_until_data_changes(self):
+        url = reverse('api_space_detail', args=[self.spaces[0].site_id, self.spaces[0].pk])
+        etag = self.client.get(url)['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        OccupancyLog.objects.create(space=self.spaces[0], occupied_count=9)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['occupancy_color'], 'red')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_tokens_are_shared_with_other_processes(self):
+        url = reverse('api_space_list', args=[self.spaces[0].site_id])
+        etag = self.client.get(url)['ETag']
+        # A worker process, like the sensor listener, records new logs
+        subprocess.run(
+            [sys.executable, '-c', f'from django.conf import settings; settings.CACHES = {TEST_CACHES!r}; '
+             'import django; django.setup(); from core.utils import bump_data_version; '
+             f'bump_data_version("logs", {self.spaces[0].site_id})'],
+            check=True, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'coworking_occupancy.settings'},
+        )
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MultiSiteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.north = Site.objects.create(name='North', slug='north')
+        cls.south = Site.objects.create(name='South', slug='south')
+        cls.north_space = make_space(site=cls.north, name='North Desk', capacity=4, description='', price_per_hour=5)
+        cls.south_space = make_space(site=cls.south, name='South Desk', capacity=4, description='', price_per_hour=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_and_writes_stay_within_a_site(self):
+        response = self.client.get(reverse('space_list', args=[self.north.pk]))
+        self.assertEqual([space.pk for space in response.context['spaces']], [self.north_space.pk])
+
+        url = reverse('api_space_list', args=[self.north.pk])
+        etag = self.client.get(url)['ETag']
+        log = OccupancyLog.objects.create(space=self.south_space, occupied_count=3)
+        Booking.objects.create(
+            user=self.user, space=self.south_space,
+            start_time=timezone.now(), end_time=timezone.now() + datetime.timedelta(hours=1),
+        )
+        self.assertEqual(log.site_id, self.south.pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('api_space_list', args=[self.south.pk])).json()['spaces'][0]['booked_now'], 1)
+        self.assertEqual(self.client.get(reverse('api_space_detail', args=[self.north.pk, self.south_space.pk])).status_code, 404)
+
+    def test_site_list_redirects_when_there_is_one_site(self):
+        self.assertContains(self.client.get(reverse('site_list')), 'South')
+        self.south.delete()
+        self.assertRedirects(self.client.get(reverse('site_list')), reverse('space_list', args=[self.north.pk]))
+
+    def test_moving_a_space_moves_its_data(self):
+        OccupancyLog.objects.create(space=self.south_space, occupied_count=3)
+        Booking.objects.create(
+            user=self.user, space=self.south_space,
+            start_time=timezone.now(), end_time=timezone.now() + datetime.timedelta(hours=1),
+        )
+        version = data_version('logs', self.north.pk)
+        self.south_space.site = self.north
+        self.south_space.save()
+        self.assertEqual(OccupancyLog.objects.get().site_id, self.north.pk)
+        self.assertEqual(Booking.objects.get().site_id, self.north.pk)
+        self.assertNotEqual(data_version('logs', self.north.pk), version)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BookingLifecycleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('member')
+        cls.space = space = make_space(name='Desk', capacity=5, description='', price_per_hour=5)
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        site = space.site
+        Booking.objects.bulk_create(
+            [Booking(user=user, space=space, site=site, start_time=now - 3 * hour, end_time=now - hour) for _ in range(25)]
+            + [Booking(user=user, space=space, site=site, start_time=now - hour, end_time=now + hour)]
+            + [Booking(user=user, space=space, site=site, start_time=now - 3 * hour, end_time=now - hour, status='cancelled')]
+        )
+
+    def test_chunked_and_idempotent(self):
+        version = data_version('bookings', self.space.site_id)
+        chunks = []
+        total = complete_expired_bookings(chunk_size=10, on_chunk=lambda updated, total: chunks.append(updated))
+        self.assertEqual(total, 25)
+        self.assertEqual(chunks, [10, 10, 5])
+        self.assertEqual(Booking.objects.filter(status='completed').count(), 25)
+        self.assertEqual(Booking.objects.filter(status='cancelled').count(), 1)
+        self.assertEqual(Booking.objects.filter(status='confirmed').count(), 1)
+        self.assertNotEqual(data_version('bookings', self.space.site_id), version)
+        # A second run finds nothing left to do
+        self.assertEqual(complete_expired_bookings(chunk_size=10), 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('complete_bookings', chunk_size=100, stdout=out)
+        self.assertIn('Completed 25 expired bookings', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecurringBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.space = make_space(name='Desk', capacity=2, description='', price_per_hour=5)
+        cls.start = timezone.now().replace(minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+
+    def book(self, start, hours=2):
+        return Booking.objects.create(user=self.user, space=self.space, start_time=start, end_time=start + datetime.timedelta(hours=hours))
+
+    def test_expand_weekdays(self):
+        occurrences = expand_recurrence(self.start, self.start + datetime.timedelta(hours=1), 'weekdays', (self.start + datetime.timedelta(days=13)).date())
+        self.assertEqual(len(occurrences), 10)
+        self.assertTrue(all(start.weekday() < 5 for start, _ in occurrences))
+
+    def test_far_until_is_rejected_without_expanding(self):
+        started = time.perf_counter()
+        with self.assertRaises(ValidationError):
+            expand_recurrence(self.start, self.start + datetime.timedelta(hours=1), 'daily', datetime.date(9999, 12, 30))
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+    def test_repeat_is_optional(self):
+        self.client.force_login(self.user)
+        form = {
+            'start_time': self.start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (self.start + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+        }
+        response = self.client.post(reverse('book_space', args=[self.space.pk]), form)
+        self.assertRedirects(response, reverse('booking_list'), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.filter(series=None).count(), 1)
+
+    def test_conflicts_use_peak_concurrency(self):
+        hour = datetime.timedelta(hours=1)
+        # Two bookings inside the slot that never overlap leave a seat free
+        self.book(self.start, hours=1)
+        self.book(self.start + hour, hours=1)
+        slot = [(self.start, self.start + 2 * hour)]
+        self.assertEqual(find_capacity_conflicts(self.space, slot), [])
+        self.book(self.start + hour, hours=3)
+        self.assertEqual(find_capacity_conflicts(self.space, slot), slot)
+        # Back-to-back with the full hour is fine
+        self.assertEqual(find_capacity_conflicts(self.space, [(self.start + 4 * hour, self.start + 5 * hour)]), [])
+
+    def test_year_of_daily_bookings_in_one_batch(self):
+        self.client.force_login(self.user)
+        self.book(self.start + datetime.timedelta(days=100))
+        form = {
+            'start_time': self.start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (self.start + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'repeat': 'daily',
+            'repeat_until': (self.start + datetime.timedelta(days=364)).date().isoformat(),
+        }
+        url = reverse('book_space', args=[self.space.pk])
+        started = time.perf_counter()
+        response = self.client.post(url, form)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertRedirects(response, reverse('booking_list'), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.exclude(series=None).count(), 365)
+
+        # Now day 100 is full, so the whole series is rejected
+        response = self.client.post(url, form)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('fully booked', str(response.context['form'].non_field_errors()))
+        self.assertEqual(Booking.objects.count(), 366)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IngestBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.space = make_space(name='Hall', capacity=50, description='', price_per_hour=5)
+        cls.now = timezone.now().replace(microsecond=0)
+
+    def setUp(self):
+        detector.reset()
+
+    def reading(self, seconds, sensor='door-1', count=3):
+        return {
+            'space_id': self.space.pk, 'sensor_id': sensor,
+            'timestamp': self.now + datetime.timedelta(seconds=seconds), 'occupied_count': count,
+        }
+
+    def test_deduplicates_and_flushes_on_size(self):
+        buffer = IngestBuffer(max_batch=10, max_delay=60)
+        self.assertEqual(buffer.add_many([self.reading(i % 6) for i in range(9)]), 6)
+        self.assertEqual(buffer.metrics()['backlog'], 6)
+        self.assertEqual(buffer.metrics()['duplicates'], 3)
+        # Sites of the spaces, detector warm-up, savepoint, one INSERT, release
+        with self.assertNumQueries(5):
+            buffer.add_many([self.reading(i) for i in range(6, 10)])
+        self.assertEqual(OccupancyLog.objects.count(), 10)
+        metrics = buffer.metrics()
+        self.assertEqual((metrics['backlog'], metrics['flushed'], metrics['flushes']), (0, 10, 1))
+        self.assertIsNotNone(metrics['flush_ms_p99'])
+
+    def test_retries_after_flush_are_ignored_by_the_database(self):
+        buffer = IngestBuffer(max_batch=100)
+        buffer.add(**self.reading(0))
+        buffer.flush()
+        buffer.add(**self.reading(0, count=7))
+        buffer.flush()
+        self.assertEqual(OccupancyLog.objects.get().occupied_count, 3)
+
+    def test_readings_of_unknown_spaces_are_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.spool')
+            buffer = IngestBuffer(spool_path=path, max_batch=3, max_delay=60)
+            buffer.add(**{**self.reading(0), 'space_id': self.space.pk + 1000})
+            buffer.add_many([self.reading(i) for i in range(1, 5)])
+            metrics = buffer.metrics()
+            self.assertEqual((metrics['backlog'], metrics['flushed'], metrics['rejected']), (0, 4, 1))
+            # A restart replays the spool without tripping over bad readings
+            buffer.spool.close()
+            with open(path, 'a') as spool:
+                spool.write(json.dumps({**self.reading(9), 'space_id': 0}, default=datetime.datetime.isoformat) + '\n')
+            replayed = IngestBuffer(spool_path=path)
+            replayed.stop()
+            self.assertEqual((OccupancyLog.objects.count(), replayed.rejected), (4, 1))
+
+    def test_spool_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'readings.spool')
+            buffer = IngestBuffer(spool_path=path, max_batch=100, max_delay=60)
+            buffer.add_many([self.reading(i) for i in range(4)])
+            buffer.add(**self.reading(4))
+            # Simulate a crash: the process dies before flushing, with the
+            # spool still open, so only what reached the file survives
+            self.assertFalse(OccupancyLog.objects.exists())
+            with open(path) as spool:
+                spooled = spool.read()
+            self.assertEqual(len(spooled.splitlines()), 5)
+
+            IngestBuffer(spool_path=path).stop()
+            self.assertEqual(OccupancyLog.objects.count(), 5)
+            self.assertEqual(os.path.getsize(path), 0)
+            buffer.spool.close()
+
+            # A crash after commit but before truncation replays the same spool
+            with open(path, 'w') as spool:
+                spool.write(spooled)
+            IngestBuffer(spool_path=path).stop()
+            self.assertEqual(OccupancyLog.objects.count(), 5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AnomalyDetectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # make_logs cycles counts through 0..capacity
+        cls.space = make_space(name='Booth', capacity=2, description='', price_per_hour=5)
+
+    def setUp(self):
+        detector.reset()
+
+    def test_flags_spike_against_same_hour(self):
+        scorer = AnomalyDetector(warm=False)
+        day = datetime.timedelta(days=7)
+        start = timezone.now().replace(hour=9)
+        flags = [scorer.score(self.space.pk, start + day * i, 10 + i % 3) for i in range(MIN_SAMPLES)]
+        self.assertFalse(any(flags))
+        self.assertTrue(scorer.score(self.space.pk, start + day * MIN_SAMPLES, 45))
+        self.assertFalse(scorer.score(self.space.pk, start + day * MIN_SAMPLES, 12))
+        # Other hours keep their own window
+        self.assertFalse(scorer.score(self.space.pk, start.replace(hour=10), 45))
+
+    def test_batch_scoring_matches_single_readings(self):
+        scorer = AnomalyDetector(warm=False)
+        start = datetime.datetime(2026, 1, 5, 9, tzinfo=datetime.timezone.utc)
+        stamps = [start + datetime.timedelta(days=7 * i) for i in range(MIN_SAMPLES + 1)]
+        micros = np.array([round(stamp.timestamp() * 1_000_000) for stamp in stamps])
+        counts = np.array([10] * MIN_SAMPLES + [45])
+        ids = np.full(len(counts), self.space.pk)
+        self.assertFalse(scorer.score_many(ids[:-1], micros[:-1], counts[:-1]).any())
+        self.assertEqual(scorer.score_many(ids[-1:], micros[-1:], counts[-1:]).tolist(), [True])
+        # Both paths share the (space, weekend, hour) windows
+        self.assertEqual(len(scorer.window(self.space.pk, stamps[0])), MIN_SAMPLES + 1)
+
+    def test_save_and_ingest_set_the_flag(self):
+        make_logs(self.space, 24 * 7 * 5)
+        spike = OccupancyLog.objects.create(space=self.space, occupied_count=50)
+        self.assertTrue(spike.is_anomaly)
+        self.assertFalse(OccupancyLog.objects.create(space=self.space, occupied_count=1).is_anomaly)
+
+        buffer = IngestBuffer()
+        buffer.add(self.space.pk, spike.timestamp + datetime.timedelta(seconds=1), 50, sensor_id='door-1')
+        buffer.flush()
+        self.assertTrue(OccupancyLog.objects.get(sensor_id='door-1').is_anomaly)
+
+    def test_flagged_logs_are_left_out_of_graphs_and_backfill_restores_flags(self):
+        make_logs(self.space, 24 * 14)
+        OccupancyLog.objects.update(is_anomaly=True)
+        data = load_space_logs(self.space.pk)
+        self.assertTrue(data['is_anomaly'].all())
+        self.assertIsNone(generate_occupancy_graph(self.space.pk, remove_outliers=True, data=data))
+        self.assertIsNotNone(generate_occupancy_graph(self.space.pk, data=data))
+
+        out = StringIO()
+        call_command('flag_anomalies', stdout=out)
+        self.assertFalse(OccupancyLog.objects.filter(is_anomaly=True).exists())
+        self.assertIn(f'Scored {24 * 14} logs', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SensorListenerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.space = make_space(name='Hall', capacity=50, description='', price_per_hour=5)
+        cls.now = timezone.now().replace(microsecond=0)
+
+    def setUp(self):
+        detector.reset()
+
+    def payload(self, n, sensors=1, space_id=None):
+        return encode_records(
+            [space_id or self.space.pk] * n,
+            [self.now - datetime.timedelta(seconds=n - i) for i in range(n)],
+            np.arange(n) % 10,
+            sensors=sensors,
+            temperature=[21.5] + [np.nan] * (n - 1),
+        )
+
+    def test_stream_is_decoded_across_arbitrary_splits(self):
+        listener = SensorListener()
+        protocol = SensorStreamProtocol(listener)
+        data = self.payload(10)
+        self.assertEqual(len(data), 10 * RECORD_SIZE)
+        for offset in range(0, len(data), 7):
+            protocol.data_received(data[offset:offset + 7])
+        self.assertEqual(listener.backlog, 10)
+        records = listener.take_batch()
+        self.assertEqual(records['occupied_count'].tolist(), list(range(10)))
+        self.assertEqual(listener.backlog, 0)
+
+    def test_batch_insert_matches_orm_rows(self):
+        listener = SensorListener(sensor_prefix='gw1:')
+        with self.assertNumQueries(5):  # sites, detector warm-up, savepoint, INSERT, release
+            self.assertEqual(listener.write(decode_records(self.payload(5, sensors=[1, 2, 1, 2, 0]))), 5)
+        log = OccupancyLog.objects.order_by('timestamp').first()
+        self.assertEqual((log.site_id, log.sensor_id, log.temperature), (self.space.site_id, 'gw1:1', 21.5))
+        self.assertEqual(log.timestamp, self.now - datetime.timedelta(seconds=5))
+        self.assertIsNone(OccupancyLog.objects.order_by('timestamp')[1].temperature)
+        self.assertEqual(OccupancyLog.objects.filter(sensor_id='').count(), 1)
+
+        # Resent readings and unknown spaces are dropped
+        listener.write(decode_records(self.payload(5, sensors=[1, 2, 1, 2, 3])))
+        listener.write(decode_records(self.payload(1, space_id=self.space.pk + 100)))
+        self.assertEqual(OccupancyLog.objects.count(), 6)
+        self.assertEqual(listener.rejected, 1)
+        # So are timestamps far in the future, negative or too old
+        bad = np.frombuffer(self.payload(3, sensors=4), dtype=RECORD).copy()
+        bad['timestamp'] = [2 ** 61, -1, (self.now - datetime.timedelta(days=2)).timestamp() * 1_000_000]
+        self.assertEqual(listener.write(bad), 0)
+        self.assertEqual((OccupancyLog.objects.count(), listener.rejected), (6, 4))
+        # The ORM finds rows written by the listener through the unique key
+        self.assertTrue(OccupancyLog.objects.filter(sensor_id='gw1:3', timestamp=self.now - datetime.timedelta(seconds=1)).exists())
+
+    def test_logs_follow_a_moved_space(self):
+        listener = SensorListener()
+        listener.write(decode_records(self.payload(2, sensors=1)))
+        self.space.site = Site.objects.create(name='Annex', slug='annex')
+        self.space.save()
+        listener.write(decode_records(self.payload(2, sensors=2)))
+        self.assertEqual(set(OccupancyLog.objects.values_list('site_id', flat=True)), {self.space.site_id})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OccupancyTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.space = make_space(name='Desk', capacity=1, description='', price_per_hour=5)
+
+    def slots(self):
+        origin, timelines = get_timelines([self.space.pk])
+        return origin, timelines[self.space.pk]
+
+    def test_incremental_updates_match_rebuild(self):
+        origin, counts = self.slots()
+        self.assertEqual(len(counts), TIMELINE_SLOTS)
+        self.assertFalse(counts.any())
+
+        hour = datetime.timedelta(hours=1)
+        booking = Booking.objects.create(user=self.user, space=self.space, start_time=origin + hour, end_time=origin + 2 * hour)
+        _, counts = self.slots()
+        self.assertEqual(counts[4:8].tolist(), [1, 1, 1, 1])
+        self.assertEqual(counts.sum(), 4)
+
+        booking.start_time, booking.end_time = origin, origin + datetime.timedelta(minutes=20)
+        booking.save()
+        _, counts = self.slots()
+        self.assertEqual(counts[:3].tolist(), [1, 1, 0])
+        self.assertEqual(counts.sum(), 2)
+
+        booking.status = 'cancelled'
+        booking.save()
+        with self.assertNumQueries(1):
+            _, counts = self.slots()
+        self.assertFalse(counts.any())
+
+    def test_reads_shift_stale_timelines_without_writing(self):
+        origin = window_start()
+        slot = datetime.timedelta(minutes=15)
+        window = slot * TIMELINE_SLOTS
+        for start, end in [(origin - slot, origin + slot), (origin + window - slot, origin + window + slot), (origin + window, origin + window + 2 * slot)]:
+            Booking.objects.create(user=self.user, space=self.space, start_time=start, end_time=end)
+        # Stored three slots ago, before the window moved on
+        refresh_timelines([self.space.pk], origin - 3 * slot)
+        with CaptureQueriesContext(connection) as queries:
+            _, counts = self.slots()
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        np.testing.assert_array_equal(counts, build_counts([self.space.pk], origin)[self.space.pk])
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(OccupancyTimeline.objects.get().start, origin - 3 * slot)
+
+        self.assertEqual(store_timelines(), 1)
+        self.assertEqual(OccupancyTimeline.objects.get().start, origin)
+        self.assertEqual(store_timelines(), 0)
+
+    def test_spaces_and_sites_with_future_bookings_can_be_deleted(self):
+        start = window_start() + datetime.timedelta(days=1)
+        site = Site.objects.create(slug='annex', name='Annex')
+        spaces = [self.space, make_space(site=site, name='Booth', capacity=1, description='', price_per_hour=5)]
+        for space in spaces:
+            Booking.objects.create(user=self.user, space=space, start_time=start, end_time=start + datetime.timedelta(hours=1))
+        self.space.delete()
+        site.delete()
+        connection.check_constraints()
+        self.assertFalse(OccupancyTimeline.objects.exists())
+        self.assertFalse(Booking.objects.exists())
+
+    def test_list_page_shows_booked_occupancy(self):
+        now = timezone.now()
+        Booking.objects.create(user=self.user, space=self.space, start_time=now - datetime.timedelta(minutes=5), end_time=now + datetime.timedelta(hours=1))
+        response = self.client.get(reverse('space_list', args=[self.space.site_id]))
+        space = response.context['spaces'][0]
+        self.assertEqual((space.booked_now, space.occupancy_percentage, space.occupancy_color), (1, 100, 'red'))
+
+    def test_availability_skips_overlap_query_when_slots_are_free(self):
+        self.client.force_login(self.user)
+        store_timelines()
+        start = window_start() + datetime.timedelta(days=1)
+        form = {
+            'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (start + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'repeat': 'none',
+        }
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('book_space', args=[self.space.pk]), form)
+        # No range scan of Booking, only the INSERT
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and 'FROM "core_booking"' in query['sql']])
+        self.assertEqual(self.slots()[1].sum(), 4)
+        # The slot is now full, so a second booking is rejected by the exact check
+        response = self.client.post(reverse('book_space', args=[self.space.pk]), form)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UtilizationReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.space = make_space(name='Desk', capacity=2, description='', price_per_hour=10)
+        other = make_space(Site.objects.create(name='Other', slug='other'), name='Elsewhere', capacity=2, description='', price_per_hour=10)
+        day = lambda d, h: datetime.datetime(2024, 3, d, h, tzinfo=datetime.timezone.utc)
+        cls.now = day(6, 12)
+        Booking.objects.bulk_create([
+            Booking(user=cls.user, space=space, site_id=space.site_id, start_time=start, end_time=end, status=status)
+            for space, start, end, status in [
+                # Clipped to the window: 2h on the 4th
+                (cls.space, day(3, 22), day(4, 2), 'completed'),
+                # 4h, 24h and 4h
+                (cls.space, day(4, 20), day(6, 4), 'completed'),
+                (cls.space, day(5, 10), day(5, 12), 'confirmed'),
+                # Runs past the window: 14h on the 6th
+                (cls.space, day(6, 10), day(8, 0), 'confirmed'),
+                (cls.space, day(5, 8), day(5, 20), 'cancelled'),
+                (other, day(5, 8), day(5, 20), 'confirmed'),
+            ]
+        ])
+        make_logs(cls.space, 24, end=day(5, 23))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bookings_are_split_across_periods(self):
+        report = utilization_report(self.space.site, 'day', 3, now=self.now)
+        self.assertEqual([period.day for period in report['periods']], [4, 5, 6])
+        self.assertEqual(report['booked_hours'].tolist(), [[6, 26, 18]])
+        # Two seats open 14 hours a day
+        np.testing.assert_allclose(report['utilization'][0], [6 / 28, 26 / 28, 18 / 28])
+        self.assertEqual(report['revenue'].tolist(), [[60, 260, 180]])
+        self.assertTrue(np.isnan(report['avg_occupancy'][0, 0]))
+        self.assertAlmostEqual(report['avg_occupancy'][0, 1], np.mean([i % 3 for i in range(24)]))
+        self.assertEqual(report['totals'][0]['revenue'], 500)
+
+        # The week from Monday the 4th holds all of the last booking
+        weekly = utilization_report(self.space.site, 'week', 1, now=self.now)
+        self.assertEqual(weekly['booked_hours'].tolist(), [[74]])
+        np.testing.assert_allclose(weekly['utilization'], [[74 / (2 * 14 * 7)]])
+
+    def test_ended_periods_are_cached(self):
+        site = self.space.site
+        # Spaces, bookings and logs, however many periods
+        with self.assertNumQueries(3):
+            first = utilization_report(site, 'day', 366, now=self.now)
+        # Only the current day is read again
+        with CaptureQueriesContext(connection) as queries:
+            second = utilization_report(site, 'day', 366, now=self.now)
+        self.assertEqual(len(queries), 3)
+        self.assertFalse([query for query in queries if '2023-' in query['sql']])
+        self.assertEqual(len([query for query in queries if "'2024-03-06 00:00:00'" in query['sql']]), 2)
+        np.testing.assert_array_equal(first['booked_hours'], second['booked_hours'])
+        np.testing.assert_array_equal(first['avg_occupancy'], second['avg_occupancy'])
+
+    def test_view_is_staff_only(self):
+        url = reverse('site_report', args=[self.space.site_id])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get(url, {'period': 'week', 'count': '1000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['period'], response.context['count']), ('week', 53))
+        self.assertTrue(response.context['chart_image'])
+        self.assertContains(response, 'Desk')
+        self.assertNotContains(response, 'Elsewhere')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoadTestCommandTests(TransactionTestCase):
+    def test_short_run_reports_every_endpoint(self):
+        space = make_space(name='Open Space', capacity=10, description='', price_per_hour=5)
+        make_logs(space, 24)
+        out = StringIO()
+        call_command(
+            'loadtest', duration=1, members=2, sensors=1, sensor_rate=5,
+            book_probability=1, think_time=0.1, stdout=out,
+        )
+        report = out.getvalue()
+        for endpoint in ('space_list', 'space_detail', 'booking_form', 'book_space', 'sensor_write'):
+            self.assertIn(endpoint, report)
+        # Every simulated booking went through (requests, then errors)
+        book_row = next(line.split() for line in report.splitlines() if line.startswith('book_space'))
+        self.assertGreater(int(book_row[1]), 0)
+        self.assertEqual(book_row[2], '0')
+        # Everything the run created is cleaned up again
+        self.assertEqual(OccupancyLog.objects.count(), 24)
+        self.assertFalse(User.objects.exists())
+
+    def test_sensor_listener_benchmark(self):
+        make_space(name='Open Space', capacity=10, description='', price_per_hour=5)
+        out = StringIO()
+        call_command('sensor_listener', benchmark=5000, max_batch=1000, stdout=out)
+        self.assertIn('Ingested 5000 readings', out.getvalue())
+        self.assertFalse(OccupancyLog.objects.exists())
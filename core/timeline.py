@@ -0,0 +1,197 @@
+"""
+Booking-derived occupancy timelines.
+
+Each space keeps the number of confirmed bookings touching every
+15-minute slot of the next TIMELINE_DAYS as a uint16 array in
+OccupancyTimeline. Booking writes patch the array in place. Reads never
+write: once the window has moved on, a stored array is shifted in memory
+and only the slots that entered the window are counted from Booking, in
+one batched query. Booking writes and the complete_bookings job store the
+current window again. Every write happens under the space row lock that
+booking creation also takes, so the array never misses a concurrent
+booking.
+
+A slot counts every booking that overlaps it at all, so a slot count is an
+upper bound of the bookings active at any instant inside that slot.
+"""
+import datetime
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Booking, OccupancyTimeline, Space
+
+SLOT = datetime.timedelta(minutes=15)
+TIMELINE_DAYS = 14
+TIMELINE_SLOTS = TIMELINE_DAYS * 24 * 60 // 15
+
+
+def window_start(now=None):
+    """Start of the slot containing `now`, where the current window begins."""
+    now = now or timezone.now()
+    return now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+
+
+def slot_bounds(starts, ends, origin, slots=TIMELINE_SLOTS):
+    """
+    First and one-past-last slot index touched by each [start, end) epoch
+    second pair, clipped to the `slots` slots beginning at `origin`.
+    """
+    seconds = SLOT.total_seconds()
+    first = np.floor((np.asarray(starts, dtype=float) - origin.timestamp()) / seconds)
+    last = np.ceil((np.asarray(ends, dtype=float) - origin.timestamp()) / seconds)
+    return (np.clip(first, 0, slots).astype(np.intp),
+            np.clip(last, 0, slots).astype(np.intp))
+
+
+def build_counts(space_ids, origin, slots=TIMELINE_SLOTS):
+    """Counts of the `slots` slots from `origin` for every space, read from Booking in one query."""
+    window_end = origin + SLOT * slots
+    rows = list(Booking.objects.filter(
+        space_id__in=space_ids, status='confirmed', start_time__lt=window_end, end_time__gt=origin,
+    ).values_list('space_id', 'start_time', 'end_time'))
+
+    # Difference arrays: +1 where a booking starts touching slots, -1 after
+    diffs = np.zeros((len(space_ids), slots + 1), dtype=np.int32)
+    if rows:
+        position = {space_id: i for i, space_id in enumerate(space_ids)}
+        row_idx = np.array([position[space_id] for space_id, _, _ in rows])
+        first, last = slot_bounds(
+            [start.timestamp() for _, start, _ in rows], [end.timestamp() for _, _, end in rows], origin, slots
+        )
+        np.add.at(diffs, (row_idx, first), 1)
+        np.add.at(diffs, (row_idx, last), -1)
+    counts = np.cumsum(diffs[:, :-1], axis=1)
+    return {space_id: counts[i].astype(np.uint16) for i, space_id in enumerate(space_ids)}
+
+
+def lock_spaces(space_ids):
+    """Takes the space row locks, in primary key order to avoid deadlocks."""
+    list(Space.objects.select_for_update().filter(pk__in=space_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def refresh_timelines(space_ids, origin):
+    """Rebuilds and stores the timelines of `space_ids` for the window at `origin`."""
+    with transaction.atomic():
+        lock_spaces(space_ids)
+        counts = build_counts(space_ids, origin)
+        OccupancyTimeline.objects.filter(space_id__in=space_ids).delete()
+        OccupancyTimeline.objects.bulk_create([
+            OccupancyTimeline(space_id=space_id, start=origin, counts=space_counts.tobytes())
+            for space_id, space_counts in counts.items()
+        ])
+    return counts
+
+
+def shift_counts(stale, origin):
+    """
+    Moves stored timelines {space_id: (start, counts)} to the window at
+    `origin` without writing. Slots still inside the window are kept; the
+    slots that entered it are counted for all spaces in one query.
+    Timelines that slid out of the window entirely are rebuilt.
+    """
+    kept, rebuild = {}, []
+    for space_id, (start, counts) in stale.items():
+        shift = int((origin - start) / SLOT)
+        if 0 < shift < TIMELINE_SLOTS and start + SLOT * shift == origin:
+            kept[space_id] = (start, counts[shift:])
+        else:
+            rebuild.append(space_id)
+
+    timelines = build_counts(rebuild, origin) if rebuild else {}
+    if kept:
+        window_end = origin + SLOT * TIMELINE_SLOTS
+        tail_origin = min(start for start, _ in kept.values()) + SLOT * TIMELINE_SLOTS
+        tails = build_counts(list(kept), tail_origin, int((window_end - tail_origin) / SLOT))
+        for space_id, (start, counts) in kept.items():
+            offset = int((start + SLOT * TIMELINE_SLOTS - tail_origin) / SLOT)
+            timelines[space_id] = np.concatenate([counts, tails[space_id][offset:]])
+    return timelines
+
+
+def get_timelines(space_ids):
+    """
+    Returns (origin, {space_id: counts}) for the current window. Up-to-date
+    rows cost one query; stale rows are shifted and missing ones built in
+    memory with one more query each, without writing anything.
+    """
+    origin = window_start()
+    timelines, stale = {}, {}
+    for space_id, start, counts in OccupancyTimeline.objects.filter(
+        space_id__in=space_ids
+    ).values_list('space_id', 'start', 'counts'):
+        counts = np.frombuffer(counts, dtype=np.uint16)
+        if start == origin:
+            timelines[space_id] = counts
+        else:
+            stale[space_id] = (start, counts)
+    missing = [space_id for space_id in space_ids if space_id not in timelines and space_id not in stale]
+    if stale:
+        timelines.update(shift_counts(stale, origin))
+    if missing:
+        timelines.update(build_counts(missing, origin))
+    return origin, timelines
+
+
+def store_timelines(space_ids=None):
+    """
+    Stores the current window of every space (or of `space_ids`) whose row
+    is stale or missing. Returns how many were rebuilt. Run from the
+    complete_bookings job so reads rarely have to shift a timeline.
+    """
+    origin = window_start()
+    spaces = Space.objects.all() if space_ids is None else Space.objects.filter(pk__in=space_ids)
+    current = OccupancyTimeline.objects.filter(start=origin).values('space_id')
+    stale = list(spaces.exclude(pk__in=current).order_by('pk').values_list('pk', flat=True))
+    # Short transactions, and within the backend's parameter limits
+    for i in range(0, len(stale), 500):
+        refresh_timelines(stale[i:i + 500], origin)
+    return len(stale)
+
+
+def apply_booking_changes(space_id, removed=(), added=()):
+    """
+    Patches a space's timeline for confirmed bookings that stopped or started
+    occupying the given (start, end) slots. Called after the bookings were
+    written, so a missing or stale timeline is rebuilt from Booking instead
+    and stored for the reads that follow.
+    """
+    with transaction.atomic():
+        lock_spaces([space_id])
+        timeline = OccupancyTimeline.objects.filter(space_id=space_id).first()
+        origin = window_start()
+        if timeline is None or timeline.start != origin:
+            refresh_timelines([space_id], origin)
+            return
+
+        diffs = np.zeros(TIMELINE_SLOTS + 1, dtype=np.int32)
+        for slots, delta in ((removed, -1), (added, 1)):
+            if slots:
+                first, last = slot_bounds(
+                    [start.timestamp() for start, _ in slots], [end.timestamp() for _, end in slots], timeline.start
+                )
+                np.add.at(diffs, first, delta)
+                np.add.at(diffs, last, -delta)
+        counts = np.frombuffer(timeline.counts, dtype=np.uint16).astype(np.int32) + np.cumsum(diffs[:-1])
+        timeline.counts = np.clip(counts, 0, np.iinfo(np.uint16).max).astype(np.uint16).tobytes()
+        timeline.save(update_fields=['counts'])
+
+
+def peak_upper_bounds(timeline, occurrences):
+    """
+    Upper bound of concurrent confirmed bookings during each occurrence, or
+    None for occurrences not fully inside the timeline window.
+    """
+    origin, counts = timeline
+    window_end = origin + SLOT * TIMELINE_SLOTS
+    first, last = slot_bounds(
+        [start.timestamp() for start, _ in occurrences], [end.timestamp() for _, end in occurrences], origin
+    )
+    # Sentinel keeps every reduceat index in range
+    padded = np.append(counts, 0)
+    peaks = np.maximum.reduceat(padded, np.column_stack([first, last]).ravel())[::2]
+    return [
+        int(peak) if origin <= start and end <= window_end and a < b else None
+        for (start, end), peak, a, b in zip(occurrences, peaks, first, last)
+    ]
@@ -2,9 +2,13 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('', views.SpaceListView.as_view(), name='space_list'),
+    path('', views.SiteListView.as_view(), name='site_list'),
+    path('sites/<int:site_id>/', views.SpaceListView.as_view(), name='space_list'),
+    path('sites/<int:site_id>/report/', views.SiteReportView.as_view(), name='site_report'),
     path('space/<int:pk>/', views.SpaceDetailView.as_view(), name='space_detail'),
     path('space/<int:space_id>/book/', views.BookingCreateView.as_view(), name='book_space'),
     path('bookings/', views.BookingListView.as_view(), name='booking_list'),
     path('bookings/<int:pk>/edit/', views.BookingUpdateView.as_view(), name='booking_edit'),
+    path('api/sites/<int:site_id>/spaces/', views.SpaceApiListView.as_view(), name='api_space_list'),
+    path('api/sites/<int:site_id>/spaces/<int:pk>/', views.SpaceApiDetailView.as_view(), name='api_space_detail'),
 ]
@@ -1,46 +1,209 @@
 import matplotlib.pyplot as plt
 import base64
+import hashlib
+import time
+import uuid
 from io import BytesIO
+import numpy as np
 import pandas as pd
-from .models import OccupancyLog
+from .forecast import FEATURE_COLUMNS, LinearForecast, median_forecast
+from .models import OccupancyLog, Space
+from .reports import EpochSeconds
 import matplotlib
 import datetime
+from django.core.cache import cache, caches
+from django.db.models import Avg, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 import matplotlib.dates as mdates
 
 # Set non-interactive backend
 matplotlib.use('Agg')
 
-def generate_occupancy_graph(space_id, window_size=1, remove_outliers=False):
-    # Limit to last 7 days by default for better visibility
-    last_week = timezone.now() - datetime.timedelta(days=7)
-    logs = OccupancyLog.objects.filter(space_id=space_id, timestamp__gte=last_week).order_by('timestamp')
-    if not logs.exists(): # Fallback if no recent data
-         logs = OccupancyLog.objects.filter(space_id=space_id).order_by('-timestamp')[:100]
-         logs = reversed(logs) # Put back in chronological order
-    
-    # Check if queryset is empty again after fallback
-    # Convert to list first to reuse
-    logs_list = list(logs)
-    if not logs_list:
-        return None
+# Columns the analytics functions need from OccupancyLog, in load order
+LOG_COLUMNS = (
+    'id', 'timestamp', 'occupied_count', 'temperature', 'pressure',
+    'precipitation', 'traffic_index', 'is_holiday', 'is_anomaly',
+)
+LOG_DTYPES = {
+    'id': 'int64',
+    'occupied_count': 'int32',
+    'temperature': 'float32',
+    'pressure': 'float32',
+    'precipitation': 'float32',
+    'traffic_index': 'int8',
+    'is_holiday': 'bool',
+    'is_anomaly': 'bool',
+}
+# Incremental linear forecasts are rebuilt from all logs after this long
+LINEAR_REFIT_SECONDS = 6 * 60 * 60
 
-    df = pd.DataFrame([{'timestamp': log.timestamp, 'occupied_count': log.occupied_count} for log in logs_list])
-    
-    if df.empty:
-        return None
+def logs_frame(logs):
+    """
+    Reads LOG_COLUMNS of a log queryset into a columnar DataFrame via
+    values_list, without building model instances.
+    """
+    df = pd.DataFrame.from_records(logs.values_list(*LOG_COLUMNS).iterator(), columns=LOG_COLUMNS)
+    # Narrow dtypes keep the frame small; NULL weather readings become NaN
+    df = df.astype(LOG_DTYPES)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+def load_space_logs(space_id):
+    """
+    Fetches all logs of a space in a single query as a columnar DataFrame
+    sorted by timestamp, so one request can feed every graph builder.
+    """
+    return logs_frame(OccupancyLog.objects.filter(space_id=space_id).order_by('timestamp'))
+
+def recent_logs_from(data, space, limit=5):
+    """
+    Rebuilds the newest logs from a loaded frame as unsaved OccupancyLog
+    instances for display, newest first, without another query.
+    """
+    logs = []
+    for row in data.tail(limit).iloc[::-1].itertuples(index=False):
+        fields = row._asdict()
+        fields['timestamp'] = fields['timestamp'].to_pydatetime()
+        if pd.isna(fields['temperature']):
+            fields['temperature'] = None
+        logs.append(OccupancyLog(space=space, **fields))
+    return logs
+
+def bump_data_version(kind, site_id):
+    """
+    Marks one kind of data ('logs', 'bookings' or 'spaces') of a site as
+    changed. Called from the model signals in core/signals.py; bulk writes
+    that skip signals must call it themselves.
+    """
+    caches['tokens'].set(f'data_version:{kind}:{site_id}', uuid.uuid4().hex, None)
+
+def data_version(kind, site_id):
+    """
+    Opaque token that changes whenever `kind` changes at a site, read from
+    the cache so conditional requests never have to query the data itself.
+    Writes at one site leave the tokens of other sites alone. The tokens
+    must live in a cache shared by every process that writes data (the
+    'tokens' file cache in settings), or workers' writes never reach the
+    web process.
+    """
+    tokens = caches['tokens']
+    key = f'data_version:{kind}:{site_id}'
+    version = tokens.get(key)
+    if version is None:
+        # Unknown after a restart or eviction, start from a fresh token
+        tokens.add(key, uuid.uuid4().hex, None)
+        version = tokens.get(key)
+    return version
+
+def spaces_with_occupancy(site_id):
+    """
+    Spaces of a site annotated with booking_count and the occupied_count of
+    their latest log (current_occupancy), with amenities prefetched: two
+    queries regardless of how many spaces there are.
+    """
+    latest_log = OccupancyLog.objects.filter(space=OuterRef('pk')).order_by('-timestamp')
+    return Space.objects.filter(site_id=site_id).annotate(
+        booking_count=Count('bookings'),
+        current_occupancy=Coalesce(Subquery(latest_log.values('occupied_count')[:1]), 0),
+    ).prefetch_related('amenities').order_by('pk')
+
+def occupancy_band(current, capacity):
+    """Returns (percentage, colour) of the occupancy indicator."""
+    if capacity > 0:
+        percentage = int((current / capacity) * 100)
+    else:
+        percentage = 0
+
+    # Quick color coding for UI
+    if percentage > 80:
+        color = 'red'
+    elif percentage > 50:
+        color = 'yellow'
+    else:
+        color = 'green'
+    return percentage, color
+
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 24
+
+def generate_sparklines(spaces, hours=24):
+    """
+    Builds compact SVG path data of hourly mean occupancy (as a share of
+    capacity) over the last `hours` for every given space.
+
+    All series come from one query grouped by space and hour. Results are
+    cached until the logs or spaces of their sites change or the hour rolls
+    over; writes at other sites leave them alone.
+    Returns {space_id: path 'd' string}, spaces without logs get None.
+    """
+    spaces = list(spaces)
+    if not spaces:
+        return {}
+
+    now = timezone.now()
+    start = now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=hours - 1)
+    space_ids = [space.id for space in spaces]
+    site_ids = sorted({space.site_id for space in spaces})
+    versions = ':'.join(data_version(kind, site_id) for site_id in site_ids for kind in ('logs', 'spaces'))
+    digest = hashlib.md5(f"{versions}:{','.join(map(str, space_ids))}".encode()).hexdigest()
+    cache_key = f'sparklines:{hours}:{start:%Y%m%d%H}:{digest}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Mean per (space, hour) in SQL, at most spaces x hours rows
+    origin = int(start.timestamp())
+    rows = OccupancyLog.objects.filter(
+        space_id__in=space_ids, timestamp__gte=start, timestamp__lt=start + datetime.timedelta(hours=hours)
+    ).annotate(
+        hour=(EpochSeconds('timestamp') - Value(origin)) / Value(60 * 60),
+    ).values('space_id', 'hour').annotate(mean=Avg('occupied_count')).order_by()
+
+    means = np.full((len(spaces), hours), np.nan)
+    position = {space_id: i for i, space_id in enumerate(space_ids)}
+    for row in rows:
+        means[position[row['space_id']], row['hour']] = row['mean']
+
+    capacity = np.array([max(space.capacity, 1) for space in spaces], dtype=float)[:, None]
+    share = np.clip(means / capacity, 0, 1)
+    xs = np.linspace(0, SPARKLINE_WIDTH, hours).round(1)
+    ys = (SPARKLINE_HEIGHT * (1 - share)).round(1)
 
-    # Sort checks
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
+    sparklines = {}
+    for space_id, row in zip(space_ids, ys):
+        # Hours without logs break the line, the next point starts a new segment
+        segments = []
+        pen_down = False
+        for x, y in zip(xs, row):
+            if np.isnan(y):
+                pen_down = False
+                continue
+            segments.append(f"{'L' if pen_down else 'M'}{x:g} {y:g}")
+            pen_down = True
+        sparklines[space_id] = ''.join(segments) or None
 
-    # 1. Remove Outliers (Z-score method) if requested
-    if remove_outliers and len(df) > 10:
-        mean = df['occupied_count'].mean()
-        std = df['occupied_count'].std()
-        if std > 0:
-            # Keep rows with Z-score < 2
-            df = df[((df['occupied_count'] - mean) / std).abs() < 2]
+    cache.set(cache_key, sparklines, 60 * 60)
+    return sparklines
+
+def generate_occupancy_graph(space_id, window_size=1, remove_outliers=False, data=None):
+    if data is None:
+        data = load_space_logs(space_id)
+    if data.empty:
+        return None
+
+    # Limit to last 7 days by default for better visibility
+    last_week = timezone.now() - datetime.timedelta(days=7)
+    # 1. Drop readings flagged as anomalies on ingest if requested
+    if remove_outliers:
+        data = data[~data['is_anomaly']]
+        if data.empty:
+            return None
+    df = data.loc[data['timestamp'] >= last_week, ['timestamp', 'occupied_count']]
+    if df.empty: # Fallback if no recent data
+        df = data[['timestamp', 'occupied_count']].tail(100)
+    # Smoothing below writes floats into the column, keep the shared frame intact
+    df = df.astype({'occupied_count': 'float64'})
 
     # 2. Smoothing (Rolling Average)
     if window_size > 1:
@@ -74,22 +237,17 @@ def generate_occupancy_graph(space_id, window_size=1, remove_outliers=False):
     
     return graphic
 
-def generate_correlation_graph(space_id):
+def generate_correlation_graph(space_id, data=None):
     """
     Generates a 1x3 subplot showing correlation between Occupancy and:
     1. Temperature
     2. Precipitation
     3. Traffic Index
     """
-    logs = OccupancyLog.objects.filter(space_id=space_id).values(
-        'occupied_count', 'temperature', 'precipitation', 'traffic_index'
-    )
-    
-    if not logs.exists():
-        return None
+    if data is None:
+        data = load_space_logs(space_id)
+    df = data
 
-    df = pd.DataFrame(list(logs))
-    
     if len(df) < 5:
         return None
         
@@ -136,71 +294,47 @@ def generate_correlation_graph(space_id):
     
     return graphic
 
-def generate_prediction_graph(space_id):
-    logs = OccupancyLog.objects.filter(space_id=space_id)
-    if not logs.exists():
-        return None
+def fit_linear_forecast(space_id, data=None):
+    """
+    Returns the space's LinearForecast, folding in only the logs added since
+    the cached model was last refit. Anomalies are skipped. Models older
+    than LINEAR_REFIT_SECONDS are rebuilt from scratch, so edited, deleted
+    or re-flagged logs are picked up even while new logs keep arriving.
+    """
+    cache_key = f'linear_forecast:{space_id}'
+    model = cache.get(cache_key)
+    if model is None or time.time() - getattr(model, 'fitted_at', 0) > LINEAR_REFIT_SECONDS:
+        model = LinearForecast()
+    if data is None:
+        new = logs_frame(OccupancyLog.objects.filter(space_id=space_id, id__gt=model.last_log_id))
+    else:
+        new = data[data['id'] > model.last_log_id]
+    if not new.empty:
+        model.last_log_id = int(new['id'].max())
+        new = new[~new['is_anomaly']]
+        model.partial_fit(new['timestamp'], new[list(FEATURE_COLUMNS)], new['occupied_count'])
+        model.solve()
+        cache.set(cache_key, model, 24 * 60 * 60)
+    return model
 
-    df = pd.DataFrame(list(logs.values('timestamp', 'occupied_count')))
-    
-    if df.empty:
+def generate_prediction_graph(space_id, data=None, engine='median'):
+    if data is None:
+        data = load_space_logs(space_id)
+    if data.empty:
         return None
-        
-    # Process data to get DayOfWeek(0-6) and Hour(0-23)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['day_of_week'] = df['timestamp'].dt.dayofweek
-    df['hour'] = df['timestamp'].dt.hour
-    
-    # Calculate average occupancy for every (Day, Hour) combination
-    # Group by [Day, Hour] -> Median (More robust to outliers than Mean)
-    occupancy_model = df.groupby(['day_of_week', 'hour'])['occupied_count'].median()
-    
-    # Generate forecast for the NEXT 7 DAYS (Hourly)
-    future_dates = []
-    predicted_values = []
-    
+
     now = timezone.now()
     # Align 'now' to start of next hour for cleaner graph
     start_time = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
-    
-    for i in range(24 * 7): # 7 days * 24 hours
-        future_time = start_time + datetime.timedelta(hours=i)
-        day_of_week = future_time.weekday()
-        if day_of_week >= 5: # Weekend Adjustment
-             # Ensure weekends are visibly lower even if model says otherwise
-             # Just a safety dampener for the "coefficient" requirement
-             weekend_factor = 0.6
-        else:
-             weekend_factor = 1.0
-
-        hour = future_time.hour
-        
-        val = 0 # Default to 0
-        
-        # Lookup in model
-        try:
-            val = occupancy_model.loc[(day_of_week, hour)] * weekend_factor
-        except KeyError:
-             # Fallback: try finding avg for just the hour across all days
-             try:
-                 val = df[df['hour'] == hour]['occupied_count'].median() * weekend_factor
-             except:
-                 val = 0
-        
-        # Ensure val is not NaN
-        if pd.isna(val):
-            val = 0
-            
-        future_dates.append(future_time)
-        predicted_values.append(val)
-        
-    # Smoothing the prediction curve
-    # Predictions can be jumpy (e.g., 10am=5, 11am=15). 
-    # Apply a small rolling window to "connect" the dots better
-    pred_series = pd.Series(predicted_values)
-    smoothed_pred = pred_series.rolling(window=3, min_periods=1, center=True).mean()
-    predicted_values = smoothed_pred.tolist()
-        
+
+    # Generate forecast for the NEXT 7 DAYS (Hourly)
+    future_dates = pd.date_range(start_time, periods=24 * 7, freq='h')
+    if engine == 'linear':
+        predicted_values = fit_linear_forecast(space_id, data).predict(future_dates)
+    else:
+        # Train on normal readings only
+        predicted_values = median_forecast(data[~data['is_anomaly']], future_dates)
+
     # Plotting
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.plot(future_dates, predicted_values, color='purple', linewidth=2, label='Predicted Occupancy')
@@ -1,12 +1,43 @@
-from django.shortcuts import get_object_or_404
-from django.views.generic import ListView, DetailView, CreateView, UpdateView
-from django.contrib.auth.mixins import LoginRequiredMixin
+import hashlib
+
+from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db.models import Count
+from django.http import HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, TemplateView
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 
-from .models import Space, Booking
-from .utils import generate_occupancy_graph, generate_prediction_graph, generate_correlation_graph
-from .forms import BookingForm
+from .models import Site, Space, Booking
+from .utils import (
+    generate_occupancy_graph, generate_prediction_graph, generate_correlation_graph,
+    generate_sparklines, load_space_logs, recent_logs_from,
+    data_version, occupancy_band, spaces_with_occupancy,
+)
+from .bookings import create_bookings, reschedule_booking
+from .timeline import get_timelines, window_start
+from .reports import PERIOD_KINDS, generate_utilization_chart, utilization_report
+from .forms import BookingForm, RecurringBookingForm
+
+
+class SiteListView(ListView):
+    model = Site
+    template_name = 'core/site_list.html'
+    context_object_name = 'sites'
+
+    def get_queryset(self):
+        return Site.objects.annotate(space_count=Count('spaces')).order_by('name')
+
+    def get(self, request, *args, **kwargs):
+        sites = list(self.get_queryset()[:2])
+        # Nothing to choose with a single location
+        if len(sites) == 1:
+            return redirect('space_list', site_id=sites[0].pk)
+        return super().get(request, *args, **kwargs)
 
 
 class SpaceListView(ListView):
@@ -15,28 +46,24 @@ class SpaceListView(ListView):
     context_object_name = 'spaces'
 
     def get_queryset(self):
-        return Space.objects.annotate(booking_count=Count('bookings'))
+        self.site = get_object_or_404(Site, pk=self.kwargs['site_id'])
+        return spaces_with_occupancy(self.site.pk)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Attach current occupancy to each space in the context list
+        context['site'] = self.site
+        # 24h sparklines for all listed spaces come from one batched query
+        sparklines = generate_sparklines(context['spaces'])
+        # Current occupancy comes from active bookings (the first timeline slot),
+        # the latest measured count is annotated on the queryset
+        _, timelines = get_timelines([space.id for space in context['spaces']])
         for space in context['spaces']:
-            last_log = space.occupancy_logs.order_by('-timestamp').first()
-            space.current_occupancy = last_log.occupied_count if last_log else 0
-            
-            if space.capacity > 0:
-                space.occupancy_percentage = int((space.current_occupancy / space.capacity) * 100)
-            else:
-                space.occupancy_percentage = 0
-                
-            # Quick color coding for UI
-            if space.occupancy_percentage > 80:
-                space.occupancy_color = 'red'
-            elif space.occupancy_percentage > 50:
-                space.occupancy_color = 'yellow'
-            else:
-                space.occupancy_color = 'green'
-                
+            space.sparkline = sparklines.get(space.id)
+            space.booked_now = int(timelines[space.id][0])
+            space.occupancy_percentage, space.occupancy_color = occupancy_band(
+                space.booked_now, space.capacity
+            )
+
         return context
 
 
@@ -45,7 +72,7 @@ from core.utils import generate_occupancy_graph, generate_prediction_graph, gene
 # ... (imports)
 
 class SpaceDetailView(DetailView):
-    model = Space
+    queryset = Space.objects.select_related('site')
     template_name = 'core/space_detail.html'
     context_object_name = 'space'
 
@@ -60,15 +87,18 @@ class SpaceDetailView(DetailView):
             
         remove_outliers = self.request.GET.get('remove_outliers') == 'on'
 
+        # Fetch the log columns once and share them across all graphs
+        data = load_space_logs(self.object.id)
+
         # Optional: Add recent occupancy logs
-        context['recent_logs'] = self.object.occupancy_logs.order_by(
-            '-timestamp')[:5]
-        
+        context['recent_logs'] = recent_logs_from(data, self.object)
+
         # Generate graph with params
         context['graph_image'] = generate_occupancy_graph(
             self.object.id, 
             window_size=window_size, 
-            remove_outliers=remove_outliers
+            remove_outliers=remove_outliers,
+            data=data,
         )
         
         # Pass params back to template to maintain state
@@ -76,14 +106,48 @@ class SpaceDetailView(DetailView):
         context['remove_outliers'] = remove_outliers
         
         # Generate prediction graph
-        context['prediction_image'] = generate_prediction_graph(self.object.id)
+        context['prediction_image'] = generate_prediction_graph(
+            self.object.id, data=data, engine=self.object.forecast_engine
+        )
         
         # NEW: Correlation Graph
-        context['correlation_image'] = generate_correlation_graph(self.object.id)
+        context['correlation_image'] = generate_correlation_graph(self.object.id, data=data)
         
         return context
 
 
+class SiteReportView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Staff-only utilization and revenue per space of a site, by day or week."""
+    template_name = 'core/report.html'
+    # Default and maximum number of periods per kind
+    PERIOD_COUNTS = {'day': (30, 366), 'week': (12, 53)}
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        site = get_object_or_404(Site, pk=self.kwargs['site_id'])
+        kind = self.request.GET.get('period')
+        if kind not in PERIOD_KINDS:
+            kind = 'day'
+        default, maximum = self.PERIOD_COUNTS[kind]
+        try:
+            count = min(max(int(self.request.GET.get('count', default)), 1), maximum)
+        except ValueError:
+            count = default
+
+        report = utilization_report(site, kind, count)
+        context.update({
+            'site': site,
+            'report': report,
+            'period': kind,
+            'count': count,
+            'chart_image': generate_utilization_chart(report),
+        })
+        return context
+
+
 class BookingListView(LoginRequiredMixin, ListView):
     model = Booking
     template_name = 'core/booking_list.html'
@@ -104,6 +168,14 @@ class BookingUpdateView(LoginRequiredMixin, UpdateView):
     def get_queryset(self):
         # Ensure user can only edit their own bookings
         return Booking.objects.filter(user=self.request.user)
+
+    def form_valid(self, form):
+        try:
+            self.object = reschedule_booking(form)
+        except ValidationError as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -116,15 +188,23 @@ class BookingUpdateView(LoginRequiredMixin, UpdateView):
 
 class BookingCreateView(LoginRequiredMixin, CreateView):
     model = Booking
-    form_class = BookingForm
+    form_class = RecurringBookingForm
     template_name = 'core/booking_form.html'
     success_url = reverse_lazy('booking_list')
 
     def form_valid(self, form):
         space = get_object_or_404(Space, pk=self.kwargs['space_id'])
-        form.instance.space = space
-        form.instance.user = self.request.user
-        return super().form_valid(form)
+        occurrences = form.cleaned_data['occurrences']
+        # All occurrences are checked in one query and inserted in one batch
+        try:
+            bookings = create_bookings(self.request.user, space, occurrences)
+        except ValidationError as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        self.object = bookings[0]
+        if len(bookings) > 1:
+            messages.success(self.request, f"Booked {space.name} for {len(bookings)} occurrences.")
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -132,3 +212,50 @@ class BookingCreateView(LoginRequiredMixin, CreateView):
             Space, pk=self.kwargs['space_id'])
         return context
 
+
+
+def spaces_etag(request, *args, **kwargs):
+    """
+    Strong ETag built only from the site's cached change tokens, so an
+    unchanged resource is answered with 304 without querying spaces,
+    bookings or logs.
+    """
+    site_id = kwargs['site_id']
+    versions = ':'.join(data_version(kind, site_id) for kind in ('spaces', 'bookings', 'logs'))
+    # booked_now also moves on with every timeline slot
+    versions += f':{window_start():%Y%m%d%H%M}'
+    return hashlib.md5(versions.encode()).hexdigest()
+
+
+def space_payload(space, booked_now):
+    percentage, color = occupancy_band(space.current_occupancy, space.capacity)
+    return {
+        'id': space.pk,
+        'name': space.name,
+        'capacity': space.capacity,
+        'price_per_hour': str(space.price_per_hour),
+        'amenities': [amenity.name for amenity in space.amenities.all()],
+        'booking_count': space.booking_count,
+        'current_occupancy': space.current_occupancy,
+        'booked_now': booked_now,
+        'occupancy_percentage': percentage,
+        'occupancy_color': color,
+    }
+
+
+@method_decorator(condition(etag_func=spaces_etag), name='get')
+class SpaceApiListView(View):
+    def get(self, request, site_id):
+        spaces = list(spaces_with_occupancy(site_id))
+        if not spaces:
+            get_object_or_404(Site, pk=site_id)
+        _, timelines = get_timelines([space.pk for space in spaces])
+        return JsonResponse({'spaces': [space_payload(space, int(timelines[space.pk][0])) for space in spaces]})
+
+
+@method_decorator(condition(etag_func=spaces_etag), name='get')
+class SpaceApiDetailView(View):
+    def get(self, request, site_id, pk):
+        space = get_object_or_404(spaces_with_occupancy(site_id), pk=pk)
+        _, timelines = get_timelines([space.pk])
+        return JsonResponse(space_payload(space, int(timelines[space.pk][0])))
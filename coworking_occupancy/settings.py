@@ -83,6 +83,30 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/ref/settings/#caches
+# Shared on disk so the change tokens bumped by the sensor listener and the
+# management commands reach the web processes. Every set on a file cache
+# lists its whole directory to decide whether to cull, so the tokens, which
+# are bumped on every saved log and booking, get a directory of their own
+# with one file per site and kind, never culled. The default cache only
+# takes writes on misses; utilization reports keep one entry per site and
+# period there, a year of days would not fit the default 300.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "default",
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    "tokens": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "tokens",
+        "OPTIONS": {"MAX_ENTRIES": 1000000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -5,7 +5,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "coworking_occupancy.settings")
 django.setup()
 
 from django.contrib.auth.models import User
-from core.models import Amenity, Space, Booking, OccupancyLog
+from core.models import Amenity, Site, Space, Booking, OccupancyLog
 from django.utils import timezone
 import datetime
 import random
@@ -26,14 +26,18 @@ def seed():
     projector = Amenity.objects.create(name='Projector')
     whiteboard = Amenity.objects.create(name='Whiteboard')
 
+    # Create sites
+    downtown = Site.objects.create(name='Downtown', slug='downtown')
+    riverside = Site.objects.create(name='Riverside', slug='riverside')
+
     # Create spaces
-    space1 = Space.objects.create(name='Main Open Space', capacity=20, description='Open area desk', price_per_hour=5.00)
+    space1 = Space.objects.create(site=downtown, name='Main Open Space', capacity=20, description='Open area desk', price_per_hour=5.00)
     space1.amenities.add(wifi, coffee)
     
-    space2 = Space.objects.create(name='Meeting Room Alpha', capacity=6, description='Small meeting room', price_per_hour=25.00)
+    space2 = Space.objects.create(site=downtown, name='Meeting Room Alpha', capacity=6, description='Small meeting room', price_per_hour=25.00)
     space2.amenities.add(wifi, projector, whiteboard)
     
-    space3 = Space.objects.create(name='Quiet Zone', capacity=10, description='Silent work area', price_per_hour=8.00)
+    space3 = Space.objects.create(site=riverside, name='Quiet Zone', capacity=10, description='Silent work area', price_per_hour=8.00)
     space3.amenities.add(wifi)
 
     # Create bookings